@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import functools
+from collections import OrderedDict
+import json
+import os
+import time
+from fastapi.encoders import jsonable_encoder
+from . import crud
+from .database import get_db, run_db
+
+# Seconds during which the crawl generation is not read again from the database
+GENERATION_TTL = float(os.getenv("CACHE_GENERATION_TTL", "5"))
+
+# Maximum number of responses kept by the in-process cache
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+
+# Optional shared backend, e.g. redis://localhost:6379/0 (requires the redis package)
+CACHE_URL = os.getenv("CACHE_URL")
+
+
+class MemoryBackend:
+    """
+    In-process cache backend. Only the entries of the current generation are kept,
+    and at most max_entries of them: the keys hold the route arguments chosen by
+    the clients, so the least recently used entries are evicted beyond that.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.generation = None
+        self.entries = OrderedDict()
+
+    async def get(self, generation, key):
+        if generation != self.generation or key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    async def set(self, generation, key, value):
+        if generation != self.generation:
+            self.generation = generation
+            self.entries = OrderedDict()
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class RedisBackend:
+    """
+    Cache backend shared by all the API processes. Entries of old generations
+    are never read again and expire after a day.
+    """
+
+    def __init__(self, url):
+        import redis.asyncio
+
+        self.client = redis.asyncio.Redis.from_url(url)
+
+    async def get(self, generation, key):
+        value = await self.client.get(f"books-api:{generation}:{key}")
+        return None if value is None else json.loads(value)
+
+    async def set(self, generation, key, value):
+        await self.client.set(f"books-api:{generation}:{key}", json.dumps(value), ex=86400)
+
+
+class ResponseCache:
+    """
+    Cache of route responses keyed on the crawl generation.
+
+    The data only changes when a crawl finishes and the Scrapy pipeline
+    records it in crawl_runs, so a response stays valid until the
+    generation changes. The generation itself is read at most every
+    GENERATION_TTL seconds.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.generation = None
+        self.checked_at = 0.0
+
+    async def get_generation(self, db):
+        """
+        Returns the current crawl generation.
+        """
+        if self.generation is None or time.monotonic() - self.checked_at > GENERATION_TTL:
+            self.generation = await run_db(db, crud.get_crawl_generation)
+            self.checked_at = time.monotonic()
+        return self.generation
+
+    async def get(self, db, key, compute):
+        """
+        Returns the cached value of key for the current generation,
+        computing it with the coroutine function compute on a miss.
+        """
+        generation = await self.get_generation(db)
+        value = await self.backend.get(generation, key)
+        if value is None:
+            value = jsonable_encoder(await compute())
+            await self.backend.set(generation, key, value)
+        return value
+
+
+response_cache = ResponseCache(RedisBackend(CACHE_URL) if CACHE_URL else MemoryBackend())
+
+
+def cached(route):
+    """
+    Decorator caching the response of a route until the next crawl.
+
+    The route must take its session as the db keyword argument. The cache key
+    is built from the route name and its other arguments.
+    """
+    @functools.wraps(route)
+    async def wrapper(**kwargs):
+        args = sorted((name, value) for name, value in kwargs.items() if name != "db")
+        key = f"{route.__module__}.{route.__name__}:{args!r}"
+        return await response_cache.get(kwargs["db"], key, lambda: route(**kwargs))
+
+    return wrapper
+
+
+# Routes whose responses only change with the crawl generation. The stats
+# are computed from category_stats, refreshed once at the end of a crawl and
+# cached until the next one. The books, categories and changes are written
+# batch by batch while a crawl runs, so they must not be answered with 304.
+ETAG_PREFIXES = ("/stats",)
+
+
+class ETagMiddleware:
+    """
+    ASGI middleware answering conditional GET requests with the crawl generation.
+
+    The GET and HEAD responses of the ETAG_PREFIXES routes get a weak ETag
+    built from the current generation. A request whose If-None-Match holds
+    that ETag gets a 304 straight away, without running the route or its
+    queries: no crawl finished since the client received its copy.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not scope["path"].startswith(ETAG_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with contextlib.asynccontextmanager(get_db)() as db:
+                generation = await response_cache.get_generation(db)
+        except Exception as e:
+            print(f"⚠️ No ETag, the crawl generation could not be read: {str(e)}")
+            await self.app(scope, receive, send)
+            return
+
+        etag = f'W/"gen-{generation}"'.encode("latin-1")
+        headers = [(b"etag", etag), (b"cache-control", b"no-cache")]
+
+        if etag_matches(scope, etag):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {**message, "headers": [*message.get("headers", []), *headers]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+def etag_matches(scope, etag):
+    """
+    Returns True if the If-None-Match header of the request holds etag (or *).
+    The comparison is weak, as required for If-None-Match.
+    """
+    for name, value in scope["headers"]:
+        if name == b"if-none-match":
+            candidates = [candidate.strip() for candidate in value.split(b",")]
+            return b"*" in candidates or any(
+                candidate.removeprefix(b"W/") == etag.removeprefix(b"W/") for candidate in candidates
+            )
+    return False
@@ -1,90 +1,177 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, or_, select
+import re
+from datetime import datetime
 from . import models
 
+# Number of rows fetched per round trip from the server-side cursor in stream mode
+STREAM_CHUNK_SIZE = 500
+
+
+def select_book_rows(db: Session, ids):
+    """
+    Returns the books whose id is selected by the query ids as plain tuples:
+    (id, upc, title, description, rating, category_id, category_name,
+    stock_id, price, availability, stock_count), sorted by id.
+
+    The category and stock are joined in SQL and no ORM object is built,
+    see serialization.book_row_to_dict().
+    """
+    ids = ids.subquery()
+    statement = (
+        select(
+            models.Book.id, models.Book.upc, models.Book.title, models.Book.description, models.Book.rating,
+            models.Category.id, models.Category.name,
+            models.Stock.id, models.Stock.price, models.Stock.availability, models.Stock.stock_count,
+        )
+        .outerjoin(models.Category, models.Book.category_id == models.Category.id)
+        .outerjoin(models.Stock, models.Stock.book_id == models.Book.id)
+        .where(models.Book.id.in_(select(ids.c.id)))
+        .order_by(models.Book.id)
+    )
+    return db.execute(statement).all()
+
+
+def paginate(query, after_id: int | None = None, limit: int | None = None, stream: bool = False, fast: bool = False):
+    """
+    Apply keyset pagination to a query on books and run it.
+
+    The books are sorted by id, and only those whose id is greater than after_id
+    are returned, at most limit of them. To get the next page, pass the id of
+    the last book received as after_id.
+
+    With stream=True, the rows are not loaded at once: an iterator is returned,
+    which reads them from a server-side cursor STREAM_CHUNK_SIZE at a time.
+    Otherwise, with fast=True, the books are returned as plain tuples by select_book_rows().
+    """
+    query = query.order_by(models.Book.id)
+    if after_id is not None:
+        query = query.filter(models.Book.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    if stream:
+        return query.yield_per(STREAM_CHUNK_SIZE)
+    if fast:
+        return select_book_rows(query.session, query.with_entities(models.Book.id))
+    return query.all()
+
+
+def query_books(db: Session):
+    """
+    Returns a query on books that loads their category and stock eagerly.
+
+    The category is joined in the same SELECT and the stocks of all the books
+    are loaded by a single extra SELECT ... WHERE book_id IN (...), so
+    serializing the books as schemas.Book does not trigger one lazy load per book.
+    """
+    return db.query(models.Book).options(
+        joinedload(models.Book.category),
+        selectinload(models.Book.stock),
+    )
+
 
 # BOOKS FUNCTIONS
 
-def get_books(db: Session):
+def get_books(db: Session, **page):
     """
     Returns a list of all books in the database.
     """
-    return db.query(models.Book).all()
+    return paginate(query_books(db), **page)
 
 
 def get_book_by_upc(db: Session, upc: str):
     """
     Returns a single book matching the given UPC, or None if no book is found.
     """
-    return db.query(models.Book).filter(models.Book.upc == upc).first()
+    return query_books(db).filter(models.Book.upc == upc).first()
 
 
-def get_books_by_title(db: Session, title: str):
+def get_books_by_title(db: Session, title: str, limit: int = 50, offset: int = 0):
     """
-    Returns a list of all books in the database whose title contains the given title.
+    Returns a ranked list of the books matching the given search text.
+
+    A book matches if its title or description contains all the words of the text,
+    the last letters of each word being optional (prefix matching), or if its title
+    is similar to the text (trigram similarity, which tolerates typos).
+    The full-text and trigram searches are both served by GIN indexes.
+    The books are sorted by full-text rank, then by title similarity.
     """
-    return db.query(models.Book).filter(models.Book.title.ilike(f"%{title}%")).all()
+    words = re.findall(r"\w+", title.lower())
+    tsquery = func.to_tsquery("english", " & ".join(f"{word}:*" for word in words))
+    rank = func.ts_rank(models.Book.search_vector, tsquery)
+    similarity = func.similarity(models.Book.title, title)
+
+    return (
+        query_books(db)
+        .filter(or_(models.Book.search_vector.op("@@")(tsquery), models.Book.title.op("%")(title)))
+        .order_by(rank.desc(), similarity.desc(), models.Book.id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
 
 
-def get_books_by_category(db: Session, category_name: str):        
+def get_books_by_category(db: Session, category_name: str, **page):
     """
     Returns a list of all books in the database whose category matches the given category name.
     The search is case-insensitive and will match any books whose category name contains the given string.
     """
-    return (
-        db.query(models.Book)
+    query = (
+        query_books(db)
         .join(models.Category)
         .filter(models.Category.name.ilike(category_name))
-        .all()
     )
+    return paginate(query, **page)
 
 
-def get_books_below_stock(db: Session, threshold: int):
+def get_books_below_stock(db: Session, threshold: int, **page):
     """
     Returns a list of all books in the database whose stock count is below the given threshold.
     The search is case-insensitive and will match any books whose stock count is below the given threshold.
     """
-    return (
-        db.query(models.Book)
+    query = (
+        query_books(db)
         .join(models.Stock)
         .filter(models.Stock.stock_count < threshold)
-        .all()
     )
+    return paginate(query, **page)
 
 
-def get_books_by_rating(db: Session, min_rating: int):
+def get_books_by_rating(db: Session, min_rating: int, **page):
     """
     Returns a list of all books in the database whose rating is greater than or equal to the given min_rating.
     """
-    return db.query(models.Book).filter(models.Book.rating >= min_rating).all()
+    return paginate(query_books(db).filter(models.Book.rating >= min_rating), **page)
 
 
-def get_books_in_stock(db: Session):
+def get_books_in_stock(db: Session, **page):
     """
     Returns a list of all books in the database whose stock count is greater than zero.
-    The search is case-insensitive and will match any books whose stock count is greater than zero.
+    The availability is normalized to "In stock" or "Out of stock" by the Scrapy pipeline,
+    so it is compared exactly, which lets the query use the index on the column.
     """
-    return (
-        db.query(models.Book)
+    query = (
+        query_books(db)
         .join(models.Stock)
-        .filter(models.Stock.availability.ilike("in stock"))
-        .all()
+        .filter(models.Stock.availability == "In stock")
     )
+    return paginate(query, **page)
 
 
-def get_books_out_of_stock(db: Session):
+def get_books_out_of_stock(db: Session, **page):
     """
     Returns a list of all books in the database whose stock count is zero or lower.
-    The search is case-insensitive and will match any books whose stock count is zero or lower.
+    The availability is normalized to "In stock" or "Out of stock" by the Scrapy pipeline,
+    so it is compared exactly, which lets the query use the index on the column.
     """
-    return (
-        db.query(models.Book)
+    query = (
+        query_books(db)
         .join(models.Stock)
-        .filter(models.Stock.availability.ilike("out of stock"))
-        .all()
+        .filter(models.Stock.availability == "Out of stock")
     )
+    return paginate(query, **page)
 
 
 
@@ -98,8 +185,39 @@ def get_categories(db: Session):
 
 
 
+# CHANGES FUNCTIONS
+
+def get_stock_changes(db: Session, after_id: int = 0, since: datetime | None = None, limit: int = 1000):
+    """
+    Returns the stock changes whose id is greater than after_id, in id order, with the UPC and title of their book.
+    If since is given, only the changes recorded from that date are returned.
+    The list is limited to the given number of changes: to get the next ones, pass the id of the last change as after_id.
+
+    The pages follow the id and not recorded_at, which is the start time of
+    the writing transaction: a whole batch, or the backfill of migration 3,
+    shares the same date, and a limit cutting through it would lose the rest.
+    """
+    query = (
+        db.query(models.StockHistory, models.Book.upc, models.Book.title)
+        .join(models.Book, models.StockHistory.book_id == models.Book.id)
+        .filter(models.StockHistory.id > after_id)
+    )
+    if since is not None:
+        query = query.filter(models.StockHistory.recorded_at >= since)
+    return query.order_by(models.StockHistory.id).limit(limit).all()
+
+
+
 # STATS FUNCTIONS
 
+def get_crawl_generation(db: Session):
+    """
+    Returns the id of the last finished crawl, or 0 if no crawl was recorded.
+    The data only changes when a crawl finishes, so this number identifies its version.
+    """
+    return db.query(func.coalesce(func.max(models.CrawlRun.id), 0)).scalar()
+
+
 def get_average_price(db: Session):
     """
     Returns the average price of all books in the database.
@@ -111,7 +229,19 @@ def get_average_price_by_category(db: Session):
     """
     Returns a list of dictionaries containing the name of a category and the average price of all books in that category.
     The list is sorted by category name.
+
+    The values are read from the category_stats summary table refreshed at the
+    end of each crawl. Until it is filled, they are computed from the stocks.
     """   
+    summary = (
+        db.query(models.Category.name, models.CategoryStats.avg_price)
+        .join(models.CategoryStats, models.Category.id == models.CategoryStats.category_id)
+        .order_by(models.Category.name)
+        .all()
+    )
+    if summary:
+        return summary
+
     return (
         db.query(models.Category.name, func.avg(models.Stock.price))
         .join(models.Book, models.Category.id == models.Book.category_id)
@@ -132,7 +262,19 @@ def get_books_count_by_category(db: Session):
     """
     Returns a list of dictionaries containing the name of a category and the count of all books in that category.
     The list is sorted by category name.
+
+    The values are read from the category_stats summary table refreshed at the
+    end of each crawl. Until it is filled, they are computed from the books.
     """
+    summary = (
+        db.query(models.Category.name, models.CategoryStats.book_count)
+        .join(models.CategoryStats, models.Category.id == models.CategoryStats.category_id)
+        .order_by(models.Category.name)
+        .all()
+    )
+    if summary:
+        return summary
+
     return (
         db.query(models.Category.name, func.count(models.Book.id))
         .join(models.Book, models.Category.id == models.Book.category_id)
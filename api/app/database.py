@@ -1,33 +1,69 @@
 # -*- coding: utf-8 -*-
 
+from typing import Union
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 SQLALCHEMY_DATABASE_URL =  os.getenv("DB_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+# Set DB_ASYNC=1 to serve the API through an asyncio engine (asyncpg driver)
+DB_ASYNC = os.getenv("DB_ASYNC", "").lower() in ("1", "true", "yes")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DB_URL") or SQLALCHEMY_DATABASE_URL.replace(
+    "postgresql://", "postgresql+asyncpg://", 1
+)
+
+# Set SQL_ECHO=1 to log every SQL statement (development only, see /metrics for the query costs)
+SQL_ECHO = os.getenv("SQL_ECHO", "").lower() in ("1", "true", "yes")
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=SQL_ECHO)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if DB_ASYNC:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=SQL_ECHO)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
+AnySession = Union[Session, AsyncSession]
+
+
+async def get_db():
     """
     Yield a database session object using a context manager.
 
-    This function creates a database session object using the
-    SessionLocal class from sqlalchemy.orm. The session object
-    is then yielded using a context manager, which ensures that
+    With DB_ASYNC, the session is an AsyncSession of the asyncio engine,
+    otherwise it is a SessionLocal from sqlalchemy.orm. In both cases
     the session is properly closed after it is no longer needed.
 
     Yields:
-        SessionLocal: A database session object.
+        AsyncSession | SessionLocal: A database session object.
     """
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await run_in_threadpool(db.close)
+
+
+async def run_db(db: AnySession, fn, *args, **kwargs):
+    """
+    Run the crud function fn with the session db and return its result.
+
+    With an AsyncSession, fn runs through AsyncSession.run_sync: its queries
+    are executed by the asyncio driver and no thread is held while waiting
+    for the database. With a sync session, fn runs in the threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
@@ -1,16 +1,44 @@
 # -*- coding: utf-8 -*-
 
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import RedirectResponse
-from api.app.routers import books, categories, stats
+from api.app.routers import books, categories, stats, changes, export
+from api.app.cache import ETagMiddleware
+from api.app.metrics import MetricsMiddleware, metrics_response
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # optional dependency, gzip only without it
+    BrotliMiddleware = None
+
+# Responses smaller than this are not worth compressing
+COMPRESSION_MINIMUM_SIZE = 1000
 
 
 app = FastAPI(title="Scraped books API", version="1.0.0")
 
+# The last middleware added is the outermost one: the metrics see every
+# request, the compression applies to every body, and the 304 answers of
+# ETagMiddleware skip the routes entirely.
+app.add_middleware(ETagMiddleware)
+if BrotliMiddleware is not None:
+    # Negotiates brotli, and falls back to gzip for the clients without it
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+app.add_middleware(MetricsMiddleware)
+
 @app.get("/", include_in_schema=False)
 def root():
     return RedirectResponse(url="/docs")
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return metrics_response()
+
 app.include_router(books.router)
 app.include_router(categories.router)
 app.include_router(stats.router)
+app.include_router(changes.router)
+app.include_router(export.router)
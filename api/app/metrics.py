@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import contextvars
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from starlette.responses import Response
+from starlette.routing import Match
+from . import database
+
+REQUEST_LATENCY = Histogram(
+    "api_request_duration_seconds", "Duration of the HTTP requests", ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "api_requests_in_flight", "HTTP requests being served", ["method", "route"],
+)
+SQL_QUERY_DURATION = Histogram(
+    "api_sql_query_duration_seconds", "Duration of the SQL queries",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+SQL_QUERIES_PER_REQUEST = Histogram(
+    "api_request_sql_queries", "Number of SQL queries run by an HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+SQL_TIME_PER_REQUEST = Histogram(
+    "api_request_sql_duration_seconds", "Time spent in SQL queries by an HTTP request", ["route"],
+)
+SQL_QUERIES_OUTSIDE_REQUESTS = Counter(
+    "api_sql_queries_outside_requests", "SQL queries run outside an HTTP request",
+)
+
+
+class QueryStats:
+    """
+    SQL queries run during one HTTP request.
+    """
+    __slots__ = ("count", "duration")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# The QueryStats of the current request. The context is copied to the
+# threadpool and to the greenlets of AsyncSession.run_sync, so the queries
+# of sync routes, crud functions and streamed responses are counted too.
+current_query_stats = contextvars.ContextVar("current_query_stats", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    SQL_QUERY_DURATION.observe(elapsed)
+    stats = current_query_stats.get()
+    if stats is None:
+        SQL_QUERIES_OUTSIDE_REQUESTS.inc()
+        return
+    stats.count += 1
+    stats.duration += elapsed
+
+
+def handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """
+    Time every SQL query run by engine (a sync Engine, use .sync_engine for an AsyncEngine).
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class PoolCollector:
+    """
+    Collector reading the state of the connection pools when /metrics is scraped.
+    """
+
+    def __init__(self, engines):
+        self.engines = engines
+
+    def collect(self):
+        size = GaugeMetricFamily("api_db_pool_size", "Connections kept open by the pool", labels=["engine"])
+        checked_out = GaugeMetricFamily("api_db_pool_checked_out", "Connections in use", labels=["engine"])
+        overflow = GaugeMetricFamily("api_db_pool_overflow", "Connections opened beyond the pool size", labels=["engine"])
+        for name, engine in self.engines.items():
+            pool = engine.pool
+            if not hasattr(pool, "checkedout"):
+                continue
+            size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            overflow.add_metric([name], max(pool.overflow(), 0))
+        yield size
+        yield checked_out
+        yield overflow
+
+
+def route_template(scope):
+    """
+    Returns the path template of the route matching the request (e.g. /books/{upc}),
+    so that the metrics have one series per route and not per URL.
+
+    Only the entries of app.routes with a path are considered: some FastAPI
+    versions also list the included routers there.
+    """
+    partial = None
+    for route in scope["app"].routes:
+        path = getattr(route, "path", None)
+        if path is None:
+            continue
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return path
+        if match == Match.PARTIAL and partial is None:
+            partial = path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, the in-flight count and the SQL
+    queries of each HTTP request, labelled by route template.
+
+    The latency covers the whole response, including the body of streamed responses.
+    Once the app has run, the route found by the router (scope["route"]) is
+    preferred to the one guessed beforehand for the in-flight gauge.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or route
+            REQUEST_LATENCY.labels(method, route, status).observe(time.perf_counter() - start)
+            in_flight.dec()
+            SQL_QUERIES_PER_REQUEST.labels(route).observe(stats.count)
+            SQL_TIME_PER_REQUEST.labels(route).observe(stats.duration)
+            current_query_stats.reset(token)
+
+
+def metrics_response():
+    """
+    Returns the current metrics in the Prometheus text format.
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+engines = {"sync": database.engine}
+if database.DB_ASYNC:
+    engines["async"] = database.async_engine.sync_engine
+
+for instrumented in engines.values():
+    instrument_engine(instrumented)
+
+REGISTRY.register(PoolCollector(engines))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned schema migrations.
+
+Each migration has a version number, a description and a list of steps:
+SQL statements, or functions called with the connection. The versions
+already applied are recorded in the schema_migrations table, and
+apply_migrations() runs the missing ones in order, each in its own
+transaction. To change the schema, append a new migration to MIGRATIONS
+and update models.py accordingly; never edit an applied migration, and
+never build one from models.py, whose content changes over time.
+
+Run them with: python -m api.app.migrations
+"""
+
+from sqlalchemy import text
+from .database import engine
+
+# Serializes the migration runners started at the same time (API, crawls, ...)
+MIGRATIONS_LOCK_ID = 7_404_201
+
+
+# The migrations are frozen SQL: they must create the same schema whatever
+# models.py says today. Every statement of migration 1 is idempotent, because
+# databases created before the migrations already have some of these objects.
+MIGRATIONS = [
+    (1, "initial schema", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_categories_id ON categories (id)",
+        """
+        CREATE TABLE IF NOT EXISTS books (
+            id SERIAL PRIMARY KEY,
+            upc TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            description TEXT,
+            rating INTEGER,
+            category_id INTEGER REFERENCES categories (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_books_id ON books (id)",
+        "ALTER TABLE books ADD COLUMN IF NOT EXISTS fingerprint TEXT",
+        "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+        ") STORED",
+        "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)",
+        "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+        """
+        CREATE TABLE IF NOT EXISTS stocks (
+            id SERIAL PRIMARY KEY,
+            book_id INTEGER REFERENCES books (id),
+            price NUMERIC(6, 2),
+            availability TEXT,
+            stock_count INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_stocks_id ON stocks (id)",
+        """
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            upc TEXT NOT NULL,
+            last_seen TIMESTAMPTZ,
+            etag TEXT,
+            last_modified TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS crawl_runs (
+            id SERIAL PRIMARY KEY,
+            spider TEXT NOT NULL,
+            finished_at TIMESTAMPTZ
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_crawl_runs_id ON crawl_runs (id)",
+        """
+        CREATE TABLE IF NOT EXISTS category_stats (
+            category_id INTEGER PRIMARY KEY REFERENCES categories (id),
+            book_count INTEGER NOT NULL,
+            priced_count INTEGER NOT NULL,
+            avg_price NUMERIC,
+            min_price NUMERIC(6, 2),
+            max_price NUMERIC(6, 2),
+            avg_rating NUMERIC,
+            refreshed_at TIMESTAMPTZ
+        )
+        """,
+    ]),
+    (2, "indexes on the filter and join columns", [
+        "CREATE INDEX IF NOT EXISTS ix_books_category_id ON books (category_id)",
+        "CREATE INDEX IF NOT EXISTS ix_books_rating ON books (rating)",
+        "CREATE INDEX IF NOT EXISTS ix_stocks_book_id ON stocks (book_id)",
+        "CREATE INDEX IF NOT EXISTS ix_stocks_price ON stocks (price)",
+        "CREATE INDEX IF NOT EXISTS ix_stocks_availability ON stocks (availability)",
+    ]),
+    (3, "current stock per book and stock history", [
+        """
+        CREATE TABLE stock_history (
+            id SERIAL PRIMARY KEY,
+            book_id INTEGER REFERENCES books (id),
+            price NUMERIC(6, 2),
+            availability TEXT,
+            stock_count INTEGER,
+            recorded_at TIMESTAMPTZ DEFAULT now()
+        )
+        """,
+        "CREATE INDEX ix_stock_history_id ON stock_history (id)",
+        "CREATE INDEX ix_stock_history_book_id ON stock_history (book_id)",
+        "CREATE INDEX ix_stock_history_recorded_at ON stock_history (recorded_at)",
+        "ALTER TABLE stocks ADD COLUMN updated_at TIMESTAMPTZ DEFAULT now()",
+        # Keep in the history the rows of the former append-only stocks that differ from the previous one
+        """
+        INSERT INTO stock_history (book_id, price, availability, stock_count)
+        SELECT book_id, price, availability, stock_count
+        FROM (
+            SELECT id, book_id, price, availability, stock_count,
+                lag(id) OVER w AS previous_id,
+                lag(price) OVER w AS previous_price,
+                lag(availability) OVER w AS previous_availability,
+                lag(stock_count) OVER w AS previous_stock_count
+            FROM stocks
+            WINDOW w AS (PARTITION BY book_id ORDER BY id)
+        ) AS rows
+        WHERE previous_id IS NULL
+            OR (price, availability, stock_count)
+                IS DISTINCT FROM (previous_price, previous_availability, previous_stock_count)
+        ORDER BY id
+        """,
+        "DELETE FROM stocks USING stocks AS newer WHERE newer.book_id = stocks.book_id AND newer.id > stocks.id",
+        "DROP INDEX ix_stocks_book_id",
+        "CREATE UNIQUE INDEX ix_stocks_book_id ON stocks (book_id)",
+    ]),
+]
+
+
+def apply_migrations(bind=engine):
+    """
+    Apply the migrations that are not recorded in schema_migrations yet,
+    and return the list of the versions applied.
+    """
+    applied_now = []
+
+    with bind.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        conn.commit()
+        try:
+            with conn.begin():
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                """))
+                applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+            for version, description, steps in MIGRATIONS:
+                if version in applied:
+                    continue
+
+                print(f"📦 Applying migration {version}: {description}")
+                with conn.begin():
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(text(step))
+                    conn.execute(
+                        text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                        {"version": version, "description": description},
+                    )
+                applied_now.append(version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            conn.commit()
+
+    return applied_now
+
+
+if __name__ == "__main__":
+    versions = apply_migrations()
+    print(f"✅ Applied migrations: {versions}" if versions else "✅ The schema is up to date.")
@@ -1,9 +1,22 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import Column, Integer, Text, Numeric, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, Text, Numeric, ForeignKey, DateTime, Computed, Index, DDL, event, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from .database import Base
 
+# Weighted full-text document of a book: matches in the title rank above matches in the description
+BOOK_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+# The trigram index on the titles needs the pg_trgm extension
+event.listen(
+    Base.metadata, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -21,21 +34,78 @@ class Book(Base):
     upc = Column(Text, unique=True, nullable=False)
     title = Column(Text, nullable=False)
     description = Column(Text, nullable=True)
-    rating = Column(Integer)
-    category_id = Column(Integer, ForeignKey("categories.id"))
+    rating = Column(Integer, index=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), index=True)
+    fingerprint = Column(Text, nullable=True)
+    # Only used inside the SQL of the search, never loaded with the books
+    search_vector = deferred(Column(TSVECTOR, Computed(BOOK_SEARCH_VECTOR, persisted=True)))
 
     category = relationship("Category", back_populates="books")
     stock = relationship("Stock", back_populates="book", uselist=False)
 
+    __table_args__ = (
+        Index("ix_books_search_vector", "search_vector", postgresql_using="gin"),
+        Index(
+            "ix_books_title_trgm", "title",
+            postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+    )
+
 
 class Stock(Base):
     __tablename__ = "stocks"
 
     id = Column(Integer, primary_key=True, index=True)
-    book_id = Column(Integer, ForeignKey("books.id"))
+    book_id = Column(Integer, ForeignKey("books.id"), index=True, unique=True)
+    price = Column(Numeric(6, 2), index=True)
+    availability = Column(Text, index=True)
+    stock_count = Column(Integer, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    book = relationship("Book", back_populates="stock")
+
+
+class StockHistory(Base):
+    __tablename__ = "stock_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, ForeignKey("books.id"), index=True)
     price = Column(Numeric(6, 2))
     availability = Column(Text)
     stock_count = Column(Integer, default=0)
+    recorded_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
-    book = relationship("Book", back_populates="stock")
-    
\ No newline at end of file
+    book = relationship("Book")
+
+
+class Page(Base):
+    __tablename__ = "pages"
+
+    url = Column(Text, primary_key=True)
+    upc = Column(Text, nullable=False)
+    last_seen = Column(DateTime(timezone=True))
+    etag = Column(Text, nullable=True)
+    last_modified = Column(Text, nullable=True)
+
+
+class CrawlRun(Base):
+    __tablename__ = "crawl_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    spider = Column(Text, nullable=False)
+    finished_at = Column(DateTime(timezone=True))
+
+
+class CategoryStats(Base):
+    __tablename__ = "category_stats"
+
+    category_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    book_count = Column(Integer, nullable=False, default=0)
+    priced_count = Column(Integer, nullable=False, default=0)
+    avg_price = Column(Numeric)
+    min_price = Column(Numeric(6, 2))
+    max_price = Column(Numeric(6, 2))
+    avg_rating = Column(Numeric)
+    refreshed_at = Column(DateTime(timezone=True))
+
+    category = relationship("Category")
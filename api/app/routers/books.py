@@ -1,81 +1,143 @@
 # -*- coding: utf-8 -*-
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from .. import crud, schemas
-from ..database import get_db
+from ..serialization import FastJSONResponse, book_row_to_dict
+from ..database import get_db, run_db, AnySession, SessionLocal
 
 router = APIRouter(prefix="/books", tags=["books"])
 
 
+def pagination(
+    after_id: Optional[int] = Query(None, description="Only return the books whose id is greater than this one"),
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of books to return"),
+    stream: bool = Query(False, description="Stream the books as they are read from the database"),
+    fast: bool = Query(False, description="Skip the per-book validation and use the fast JSON encoder"),
+):
+    """
+    Keyset pagination and response mode parameters shared by the list routes.
+    To get the next page, pass the id of the last book received as after_id.
+    """
+    return {"after_id": after_id, "limit": limit, "stream": stream, "fast": fast}
+
+
+def stream_books(fetch, *args, **page):
+    """
+    Returns a response streaming the books returned by the crud function fetch
+    as a JSON array, encoding them one by one as they are read from the
+    server-side cursor.
+
+    The stream uses its own sync session, which lives as long as the response
+    body and is iterated in the threadpool.
+    """
+    def generate():
+        db = SessionLocal()
+        try:
+            yield "["
+            for index, book in enumerate(fetch(db, *args, **page)):
+                if index:
+                    yield ","
+                yield schemas.Book.model_validate(book).model_dump_json()
+            yield "]"
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/json")
+
+
+async def list_books(db: AnySession, fetch, *args, **page):
+    """
+    Returns the books of the crud function fetch, as a list or as a streamed response.
+
+    In fast mode, the books are read as plain rows and encoded directly with
+    the same shape as schemas.Book, without building and validating a model
+    per book. An empty result is still returned as a list, so that the
+    routes can answer 404.
+    """
+    if page["stream"]:
+        return stream_books(fetch, *args, **page)
+    books = await run_db(db, fetch, *args, **page)
+    if page["fast"] and books:
+        return FastJSONResponse([book_row_to_dict(row) for row in books])
+    return books
+
+
 @router.get("/", response_model=list[schemas.Book])
-def get_all_books(db: Session = Depends(get_db)):   
+async def get_all_books(page: dict = Depends(pagination), db: AnySession = Depends(get_db)):   
     """
     Returns a list of all books in the database
     """
-    return crud.get_books(db)
+    return await list_books(db, crud.get_books, **page)
 
 
 @router.get("/{upc}", response_model=schemas.Book)
-def get_book_by_upc(upc: str, db: Session = Depends(get_db)):
+async def get_book_by_upc(upc: str, db: AnySession = Depends(get_db)):
     """
     Returns a single book by its UPC.
     """
-    db_book = crud.get_book_by_upc(db, upc)
+    db_book = await run_db(db, crud.get_book_by_upc, upc)
     if db_book is None:
         raise HTTPException(status_code=404, detail="Book not found")
     return db_book
 
 
 @router.get("/search/", response_model=list[schemas.Book])
-def get_books_by_title(title: str, db: Session = Depends(get_db)):
+async def get_books_by_title(
+    title: str,
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of books to return"),
+    offset: int = Query(0, ge=0, description="Number of ranked results to skip"),
+    db: AnySession = Depends(get_db),
+):
     """
-    Returns a list of books with the given title.
+    Returns a ranked list of books matching the given title, by full-text search
+    with prefix matching over the title and description, and fuzzy title matching.
     """
-    books = crud.get_books_by_title(db, title)
+    books = await run_db(db, crud.get_books_by_title, title, limit=limit, offset=offset)
     if not books:
         raise HTTPException(status_code=404, detail="No books found with that title")
     return books
 
 
 @router.get("/category/{category_name}", response_model=list[schemas.Book])
-def books_by_category(category_name: str, db: Session = Depends(get_db)):
+async def books_by_category(category_name: str, page: dict = Depends(pagination), db: AnySession = Depends(get_db)):
     """
     Returns a list of books in the given category.
     """
-    books = crud.get_books_by_category(db, category_name)
+    books = await list_books(db, crud.get_books_by_category, category_name, **page)
     if not books:
         raise HTTPException(status_code=404, detail="No books found in this category")
     return books
 
 
 @router.get("/stock/below/{threshold}", response_model=list[schemas.Book])
-def books_below_stock(threshold: int, db: Session = Depends(get_db)):
+async def books_below_stock(threshold: int, page: dict = Depends(pagination), db: AnySession = Depends(get_db)):
     """
     Returns a list of books that have a stock count below the given threshold.
     """
-    return crud.get_books_below_stock(db, threshold)
+    return await list_books(db, crud.get_books_below_stock, threshold, **page)
 
 
 @router.get("/rating/{min_rating}", response_model=list[schemas.Book])
-def books_by_rating(min_rating: int, db: Session = Depends(get_db)):
+async def books_by_rating(min_rating: int, page: dict = Depends(pagination), db: AnySession = Depends(get_db)):
     """
     Returns a list of books that have a rating greater than or equal to the given minimum rating.
     """
-    return crud.get_books_by_rating(db, min_rating)
+    return await list_books(db, crud.get_books_by_rating, min_rating, **page)
 
 
 @router.get("/stock/in", response_model=list[schemas.Book])
-def books_in_stock(db: Session = Depends(get_db)):
+async def books_in_stock(page: dict = Depends(pagination), db: AnySession = Depends(get_db)):
     """
     Returns a list of books that are currently in stock.
     """
-    return crud.get_books_in_stock(db)
+    return await list_books(db, crud.get_books_in_stock, **page)
 
 
 @router.get("/stock/out", response_model=list[schemas.Book])
-def books_out_of_stock(db: Session = Depends(get_db)):
+async def books_out_of_stock(page: dict = Depends(pagination), db: AnySession = Depends(get_db)):
     """
     Returns a list of books that are currently out of stock.
     """
-    return crud.get_books_out_of_stock(db)
+    return await list_books(db, crud.get_books_out_of_stock, **page)
@@ -1,16 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
 from .. import crud, schemas
-from ..database import get_db
+from ..database import get_db, run_db, AnySession
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
 
 @router.get("/", response_model=list[schemas.Category])
-def list_categories(db: Session = Depends(get_db)):
+async def list_categories(db: AnySession = Depends(get_db)):
     """
     Returns a list of all categories in the database.
     """
-    return crud.get_categories(db)
+    return await run_db(db, crud.get_categories)
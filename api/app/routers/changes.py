@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from .. import crud, schemas
+from ..database import get_db, run_db, AnySession
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+
+@router.get("/", response_model=list[schemas.StockChange])
+async def stock_changes(
+    after_id: int = Query(0, ge=0, description="Only return the changes whose id is greater than this one"),
+    since: Optional[datetime] = Query(None, description="Only return the changes recorded from this date"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of changes to return"),
+    db: AnySession = Depends(get_db),
+):
+    """
+    Returns the price, availability and stock count changes, oldest first.
+    To get the next changes, pass the id of the last change received as after_id.
+    """
+    changes = await run_db(db, crud.get_stock_changes, after_id, since, limit=limit)
+    return [
+        schemas.StockChange(
+            id=change.id,
+            book_id=change.book_id,
+            upc=upc,
+            title=title,
+            price=change.price,
+            availability=change.availability,
+            stock_count=change.stock_count,
+            recorded_at=change.recorded_at,
+        )
+        for change, upc, title in changes
+    ]
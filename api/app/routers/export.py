@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import zlib
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+from ..database import engine
+from ..serialization import dumps
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_COLUMNS = ("id", "upc", "title", "description", "rating", "category", "price", "availability", "stock_count")
+
+EXPORT_BOOKS_QUERY = """
+    SELECT b.id, b.upc, b.title, b.description, b.rating, c.name,
+           s.price, s.availability, s.stock_count
+    FROM books b
+    LEFT JOIN categories c ON c.id = b.category_id
+    LEFT JOIN stocks s ON s.book_id = b.id
+    ORDER BY b.id
+"""
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def fetch_chunks(query):
+    """
+    Yield the rows of query in lists of EXPORT_CHUNK_SIZE rows.
+
+    The rows are read from a named (server-side) psycopg2 cursor, so only
+    one chunk is held in memory at a time, whatever the size of the result.
+    """
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor(name="export_books") as cursor:
+            cursor.itersize = EXPORT_CHUNK_SIZE
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        connection.close()
+
+
+def ndjson_line(row):
+    book = dict(zip(EXPORT_COLUMNS, row))
+    if book["price"] is not None:
+        book["price"] = float(book["price"])
+    return dumps(book) + b"\n"
+
+
+def encode_ndjson(chunks):
+    for rows in chunks:
+        yield b"".join(ndjson_line(row) for row in rows)
+
+
+def encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def compress(body):
+    """
+    Gzip the chunks of body on the fly. The response is sent with
+    Content-Encoding: gzip, so HTTP clients decompress it transparently.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in body:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/books")
+async def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="Export format: ndjson or csv"),
+    gzip: bool = Query(False, description="Compress the export with gzip"),
+):
+    """
+    Returns all the books with their category and current stock, one line per book.
+
+    The export is streamed from the database in chunks, so its size does not
+    change the memory used by the API.
+    """
+    encode = encode_ndjson if format == "ndjson" else encode_csv
+    body = encode(fetch_chunks(EXPORT_BOOKS_QUERY))
+    headers = {"Content-Disposition": f'attachment; filename="books.{format}"'}
+    if gzip:
+        body = compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=MEDIA_TYPES[format], headers=headers)
@@ -2,6 +2,7 @@
 
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime
 
 class Category(BaseModel):
     id: int
@@ -28,4 +29,14 @@ class Book(BaseModel):
     stock: Optional[Stock] = None
 
     model_config = {"from_attributes": True}
-    
\ No newline at end of file
+
+
+class StockChange(BaseModel):
+    id: int
+    book_id: int
+    upc: str
+    title: str
+    price: Optional[float] = None
+    availability: Optional[str] = None
+    stock_count: Optional[int] = 0
+    recorded_at: datetime
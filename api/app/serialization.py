@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import json
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the stdlib encoder is used without it
+    orjson = None
+
+
+def book_row_to_dict(row):
+    """
+    Convert a row of crud.select_book_rows() to a dict with the same shape as schemas.Book.
+    """
+    (book_id, upc, title, description, rating,
+     category_id, category_name,
+     stock_id, price, availability, stock_count) = row
+
+    return {
+        "id": book_id,
+        "upc": upc,
+        "title": title,
+        "description": description,
+        "rating": rating,
+        "category": None if category_id is None else {"id": category_id, "name": category_name},
+        "stock": None if stock_id is None else {
+            "id": stock_id,
+            "price": None if price is None else float(price),
+            "availability": availability,
+            "stock_count": stock_count,
+        },
+    }
+
+
+def dumps(content):
+    """
+    Encode content to JSON bytes with orjson, or with the stdlib encoder if it is not installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response encoded by dumps(), without the jsonable_encoder pass of FastAPI.
+    The content must already be made of JSON types.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the crawl hot path.
+
+Loads the recorded listing and detail pages of fixtures/ as HtmlResponse
+objects and measures, without any network or database access:
+- BooksSpider.parse on the listing page,
+- BooksSpider.parse_book on the detail page, with the item loader and
+  with the fast extractor,
+- every stage of ITEM_PIPELINES on the extracted items (the database
+  pipeline is replaced by the computation of its book fingerprint).
+
+For each stage it reports the throughput, the latency percentiles per call
+and the memory allocated per call (measured in a separate tracemalloc run
+so that tracing does not skew the timings).
+
+Usage: python benchmarks/bench_crawl.py [-n ITERATIONS] [--json FILE]
+"""
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scrapy_books"))
+
+from itemadapter import ItemAdapter
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.misc import load_object
+from scrapy_books import settings
+from scrapy_books.pipelines import book_fingerprint
+from scrapy_books.spiders.booksspider import BooksSpider
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+LISTING_URL = "https://books.toscrape.com/catalogue/page-2.html"
+BOOK_URL = "https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html"
+
+
+def load_response(name, url):
+    """
+    Return the fixture file as an HtmlResponse answering a request to url.
+    """
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        body = f.read()
+    return HtmlResponse(url=url, body=body, encoding="utf-8", request=Request(url))
+
+
+def fresh_response(response):
+    """
+    Return a copy of the response without its cached selector, so every
+    call pays for the HTML parsing like during a real crawl.
+    """
+    return response.replace(body=response.body)
+
+
+def measure(func, make_arg, iterations):
+    """
+    Call func(make_arg()) iterations times and return the timings and allocations.
+    Only the call of func is measured, not the preparation of its argument.
+    """
+    latencies = []
+    for _ in range(iterations):
+        arg = make_arg()
+        start = time.perf_counter_ns()
+        func(arg)
+        latencies.append(time.perf_counter_ns() - start)
+
+    allocated = []
+    tracemalloc.start()
+    for _ in range(min(iterations, 100)):
+        arg = make_arg()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - before)
+    tracemalloc.stop()
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "calls_per_sec": 1e9 * len(latencies) / sum(latencies),
+        "p50_us": quantiles[49] / 1000,
+        "p90_us": quantiles[89] / 1000,
+        "p99_us": quantiles[98] / 1000,
+        "peak_alloc_kib": statistics.mean(allocated) / 1024,
+    }
+
+
+def fingerprint_stage(item):
+    """
+    CPU part of SavingToPostgresPipeline: the fingerprint of the item.
+    """
+    book_fingerprint(ItemAdapter(item))
+    return item
+
+
+def pipeline_stages():
+    """
+    Return the (name, process_item) pairs of ITEM_PIPELINES, in order.
+    """
+    stages = []
+    for path, _ in sorted(settings.ITEM_PIPELINES.items(), key=lambda entry: entry[1]):
+        name = path.rsplit(".", 1)[-1]
+        if name == "SavingToPostgresPipeline":
+            stages.append((f"{name} (fingerprint)", fingerprint_stage))
+            continue
+        pipeline = load_object(path)()
+        stages.append((name, lambda item, pipeline=pipeline: pipeline.process_item(item, None)))
+    return stages
+
+
+def run(iterations):
+    spider = BooksSpider()
+    fast_spider = BooksSpider()
+    fast_spider.fast_extractor = True
+    listing = load_response("listing.html", LISTING_URL)
+    book = load_response("book.html", BOOK_URL)
+
+    results = {
+        "parse": measure(lambda r: list(spider.parse(r)), lambda: fresh_response(listing), iterations),
+        "parse_book": measure(lambda r: list(spider.parse_book(r)), lambda: fresh_response(book), iterations),
+        "parse_book (fast extractor)": measure(
+            lambda r: list(fast_spider.parse_book(r)), lambda: fresh_response(book), iterations
+        ),
+    }
+
+    item = next(iter(spider.parse_book(book)))
+    for name, process in pipeline_stages():
+        results[name] = measure(process, lambda: copy.deepcopy(item), iterations)
+        item = process(copy.deepcopy(item))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=1000)
+    parser.add_argument("--json", help="write the results to this file, to compare runs")
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+
+    print(f"{'stage':45} {'calls/s':>10} {'p50 µs':>9} {'p90 µs':>9} {'p99 µs':>9} {'alloc KiB':>10}")
+    for name, r in results.items():
+        print(f"{name:45} {r['calls_per_sec']:>10.0f} {r['p50_us']:>9.1f} {r['p90_us']:>9.1f} {r['p99_us']:>9.1f} {r['peak_alloc_kib']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
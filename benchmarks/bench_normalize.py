@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the item normalization stage.
+
+Compares the per-item cost of the former chain of three pipelines
+(CleanTextPipeline, AvailabilityPipeline and ConvertRatingPipeline as they
+were: uncompiled regexes, rating map rebuilt on every call) with the fused
+NormalizeItemPipeline, on BooksInformations items.
+
+Both are run through the same Deferred callback chain as the Scrapy item
+pipeline manager, one callback per pipeline, so the cost of dispatching
+the item to three stages instead of one is part of the measure.
+
+Usage: python benchmarks/bench_normalize.py [number_of_items]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+from twisted.internet import defer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scrapy_books"))
+
+from scrapy_books.items import BooksInformations
+from scrapy_books.pipelines import NormalizeItemPipeline
+
+
+class LegacyConvertRatingPipeline:
+    def process_item(self, item, spider):
+        rating_map = {"One":1, "Two":2, "Three":3, "Four":4, "Five":5}
+        rating_word = item.get("rating", "").split()[-1]
+        item["rating"] = rating_map.get(rating_word, 0)
+        return item
+
+
+class LegacyAvailabilityPipeline:
+    def process_item(self, item, spider):
+        availability_text = item.get("availability", "").strip()
+
+        item["availability"] = "Out of stock"
+        item["stock_count"] = 0
+
+        if availability_text:
+            if "In stock" in availability_text:
+                item["availability"] = "In stock"
+
+                match = re.search(r"\((\d+)\s+available\)", availability_text)
+                if match:
+                    item["stock_count"] = int(match.group(1))
+
+        return item
+
+
+class LegacyCleanTextPipeline:
+    def process_item(self, item, spider):
+        desc = item.get("description", "")
+        if desc:
+            desc = re.sub(r'\s+', ' ', desc)
+            desc = re.sub(r'[^\x20-\x7E]+', '', desc)
+            item["description"] = desc.strip()
+        return item
+
+
+def process_chain(methods, item):
+    """
+    Run item through the process_item methods as chained Deferred callbacks,
+    like the item pipeline manager of Scrapy does.
+    """
+    d = defer.Deferred()
+    for method in methods:
+        d.addCallback(method, None)
+    d.callback(item)
+    return d.result
+
+
+def make_item():
+    return BooksInformations(
+        title="A Light in the Attic",
+        price=51.77,
+        availability="\n\n    In stock (22 available)\n\n",
+        description="It's hard to imagine a world without A Light in the Attic.   This now-classic "
+                    "collection of poetry and drawings from Shel Silverstein… " * 4,
+        category="Poetry",
+        rating="star-rating Three",
+        upc="a897fe39b1053632",
+    )
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    legacy = [
+        LegacyCleanTextPipeline().process_item,
+        LegacyAvailabilityPipeline().process_item,
+        LegacyConvertRatingPipeline().process_item,
+    ]
+    fused = [NormalizeItemPipeline().process_item]
+
+    assert dict(process_chain(legacy, make_item())) == dict(process_chain(fused, make_item()))
+
+    baseline = timeit.timeit(make_item, number=number)
+    before = timeit.timeit(lambda: process_chain(legacy, make_item()), number=number) - baseline
+    after = timeit.timeit(lambda: process_chain(fused, make_item()), number=number) - baseline
+
+    print(f"{number} items")
+    print(f"before (3 pipelines): {before / number * 1e6:.2f} µs/item")
+    print(f"after (fused stage):  {after / number * 1e6:.2f} µs/item")
+    print(f"speedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Record the HTML fixtures used by bench_crawl.py from the live site.
+
+The fixtures are committed, so this is only needed to refresh them when
+books.toscrape.com changes.
+
+Usage: python benchmarks/record_fixtures.py
+"""
+
+import os
+import urllib.request
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+FIXTURES = {
+    "listing.html": "https://books.toscrape.com/catalogue/page-2.html",
+    "book.html": "https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html",
+}
+
+
+def main():
+    for name, url in FIXTURES.items():
+        with urllib.request.urlopen(url) as response:
+            body = response.read()
+        with open(os.path.join(FIXTURES_DIR, name), "wb") as f:
+            f.write(body)
+        print(f"✅ {url} -> fixtures/{name} ({len(body)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Query helpers for the Parquet snapshots written at the end of each crawl
+(see scrapy_books/scrapy_books/snapshots.py).
+
+The snapshots are opened as a pyarrow dataset: nothing is read until a
+query runs, only the requested columns and crawl runs are read, and the
+aggregations are computed by Arrow on whole columns.
+
+    from snapshots import open_snapshots, latest_run, book_count, average_price, top_categories
+
+    dataset = open_snapshots()
+    book_count(dataset)
+    top_categories(dataset, n=5).to_pandas()
+"""
+
+import os
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), "..", "snapshots"))
+
+
+def open_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Returns a lazy dataset of all the snapshots, with a crawl_run column from the partitions.
+    """
+    return ds.dataset(snapshot_dir, format="parquet", partitioning="hive")
+
+
+def latest_run(dataset):
+    """
+    Returns the id of the most recent crawl run of the dataset.
+    """
+    return pc.max(dataset.to_table(columns=["crawl_run"])["crawl_run"]).as_py()
+
+
+def load(dataset, columns=None, crawl_run=None, filter=None):
+    """
+    Returns an Arrow table with the columns of the snapshot of crawl_run
+    (the latest one by default) matching filter, a pyarrow.compute expression.
+    """
+    if crawl_run is None:
+        crawl_run = latest_run(dataset)
+    expression = ds.field("crawl_run") == crawl_run
+    if filter is not None:
+        expression &= filter
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def book_count(dataset, crawl_run=None):
+    """
+    Returns the number of books of a snapshot.
+    """
+    return load(dataset, columns=["book_id"], crawl_run=crawl_run).num_rows
+
+
+def average_price(dataset, crawl_run=None):
+    """
+    Returns the average price of the books of a snapshot.
+    """
+    return pc.mean(load(dataset, columns=["price"], crawl_run=crawl_run)["price"]).as_py()
+
+
+def top_categories(dataset, n=5, crawl_run=None):
+    """
+    Returns the n categories with the most books of a snapshot, with their
+    number of books and average price.
+    """
+    table = load(dataset, columns=["category", "price"], crawl_run=crawl_run)
+    table = table.set_column(0, "category", pc.cast(table["category"], "string"))
+    stats = table.group_by("category").aggregate([
+        ("category", "count", pc.CountOptions(mode="all")),
+        ("price", "mean"),
+    ])
+    stats = stats.rename_columns(["book_count", "avg_price", "category"])
+    return stats.sort_by([("book_count", "descending")]).slice(0, n)
+
+
+def price_history(dataset, upc):
+    """
+    Returns the price and availability of a book in every snapshot, oldest first.
+    """
+    table = dataset.to_table(
+        columns=["crawl_run", "price", "availability", "stock_count"],
+        filter=ds.field("upc") == upc,
+    )
+    return table.sort_by("crawl_run")
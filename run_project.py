@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import json
+import argparse
+import tempfile
 import psycopg2
 import subprocess
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
@@ -15,7 +18,13 @@ sys.stdout.reconfigure(encoding='utf-8')
 load_dotenv()
 
 # Importing templates after configuration
-from api.app.database import Base
+from api.app.migrations import apply_migrations
+
+SCRAPY_DIR = os.path.join(os.getcwd(), "scrapy_books")
+sys.path.insert(0, SCRAPY_DIR)
+
+from scrapy_books import settings as scrapy_settings, snapshots
+from scrapy_books.db import connection_kwargs, record_crawl_run
 
 
 def create_database():
@@ -60,13 +69,12 @@ def create_tables():
     Create the tables in the PostgreSQL database if they don't already exist.
 
     This function connects to the PostgreSQL server using the environment variables,
-    checks if the tables already exist, and creates them if they don't.
+    and applies the schema migrations of api/app/migrations.py that are missing:
+    the first one creates the tables, the next ones evolve the existing schema.
     If the tables already exist, it prints a success message.
     If an error occurs during the creation of the tables, it prints an error message.
     """
     try:
-        from api.app.models import Book, Category
-        
         engine = create_engine(
             f"postgresql://{os.getenv('USER')}:{os.getenv('PASSWORD')}@{os.getenv('HOST')}:{os.getenv('PORT')}/{os.getenv('DBNAME')}",
             echo=True
@@ -76,7 +84,7 @@ def create_tables():
         existing_tables = inspector.get_table_names()
         print(f"Tables existantes avant création : {existing_tables}")
         
-        Base.metadata.create_all(bind=engine)
+        apply_migrations(engine)
         
         inspector = inspect(engine)
         tables_after = inspector.get_table_names()
@@ -90,58 +98,223 @@ def create_tables():
 
 def run_scrapy():
     """
-    Run the Scrapy book spider.
+    Run the Scrapy book spider in a child process.
 
-    This function runs the Scrapy book spider in a subprocess and captures the output.
-    If the spider runs successfully, it prints a success message.
-    If the spider encounters an error, it prints an error message with the return code and output.
+    The output of the spider is forwarded line by line while it runs,
+    instead of being buffered until the end of the crawl.
+    Returns True if the spider ended successfully.
     """
     try:
         print("🔍 Launching scraping...")
-        process = subprocess.run(
+        process = subprocess.Popen(
             ["scrapy", "crawl", "booksspider"],
-            check=True,
-            cwd=os.path.join(os.getcwd(), "scrapy_books"),
-            capture_output=True,
-            text=True
+            cwd=SCRAPY_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
         )
-        
-        if process.stdout:
-            print("Scrapy output:", process.stdout)
-        if process.stderr:
-            print("Scrapy errors:", process.stderr)
-            
-        if process.returncode == 0:
+        for line in process.stdout:
+            print(f"[scrapy] {line}", end="")
+        returncode = process.wait()
+
+        if returncode == 0:
             print("✅ Scraping completed successfully.")
         else:
-            print(f"⚠️ Scraping ended with return code {process.returncode}")
-                
-    except subprocess.CalledProcessError as e:
-        print("❌ Error while scraping:")
-        print(f"Return code: {e.returncode}")
-        print(f"Output: {e.output}")
-        print(f"Error output: {e.stderr}")
+            print(f"⚠️ Scraping ended with return code {returncode}")
+        return returncode == 0
+
     except Exception as e:
         print("❌ Error while scraping:", str(e))
+        return False
 
 
-def run_fastpi():
+def run_scrapy_in_process():
     """
-    Try to start the FastAPI API using Uvicorn.
+    Run the Scrapy book spider in this process with a CrawlerProcess.
 
-    If successful, it will print a success message.
-    If an error occurs, it will print an error message with the error details.
+    The project settings are loaded as by the scrapy command, from the
+    Scrapy project directory, and the log is written live to the console.
+    Returns True if the spider finished normally.
+    """
+    try:
+        print("🔍 Launching scraping in process...")
+        os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "scrapy_books.settings")
+        os.chdir(SCRAPY_DIR)
+
+        from scrapy.crawler import CrawlerProcess
+        from scrapy.utils.project import get_project_settings
+
+        process = CrawlerProcess(get_project_settings())
+        crawler = process.create_crawler("booksspider")
+        process.crawl(crawler)
+        process.start()
+
+        reason = crawler.stats.get_value("finish_reason")
+        if reason == "finished":
+            print("✅ Scraping completed successfully.")
+        else:
+            print(f"⚠️ Scraping ended with reason {reason}")
+        return reason == "finished"
+
+    except Exception as e:
+        print("❌ Error while scraping:", str(e))
+        return False
+
+
+# Stats recorded with stats.max_value(): combined with max() instead of summed
+# (retry/max_reached is a count and is summed)
+MAX_STATS_SUFFIXES = ("elapsed_time_seconds", "/max", "/max_delay", "/max_seconds")
+
+
+def combine_stats(all_stats):
+    """
+    Combine the stats of several crawls: numeric values are summed, except
+    the elapsed time and the maxima (memusage/max, backoff/max_delay,
+    profile/*/max_seconds...) which keep the largest value.
+    """
+    combined = {}
+    for stats in all_stats:
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key.endswith(MAX_STATS_SUFFIXES):
+                combined[key] = max(combined.get(key, 0), value)
+            else:
+                combined[key] = combined.get(key, 0) + value
+    return combined
+
+
+def run_scrapy_sharded(shards):
+    """
+    Run the Scrapy book spider as several processes in parallel.
+
+    Each process crawls its own partition of the categories and writes to the
+    database with its own pipeline; the books are merged by the upsert on UPC.
+    The output of each shard is written to a log file, and the stats of all
+    the shards are combined and printed when they are all finished.
+
+    The shards do not record the crawl themselves: it is recorded in
+    crawl_runs and snapshotted once, after the last shard.
+    """
+    print(f"🔍 Launching scraping with {shards} shards...")
+    workdir = tempfile.mkdtemp(prefix="scrapy_shards_")
+    processes = []
+
+    for shard in range(shards):
+        log_path = os.path.join(workdir, f"shard-{shard}.log")
+        stats_path = os.path.join(workdir, f"shard-{shard}.json")
+        processes.append((shard, log_path, stats_path, subprocess.Popen(
+            [
+                "scrapy", "crawl", "booksspider",
+                "-a", f"shard={shard}", "-a", f"shards={shards}",
+                "-s", f"STATS_DUMP_FILE={stats_path}",
+                "-s", f"LOG_FILE={log_path}",
+                "-s", "RECORD_CRAWL_RUN=0",
+            ],
+            cwd=SCRAPY_DIR,
+        )))
+
+    all_stats = []
+    for shard, log_path, stats_path, process in processes:
+        returncode = process.wait()
+        if returncode == 0:
+            print(f"✅ Shard {shard} completed successfully.")
+        else:
+            print(f"⚠️ Shard {shard} ended with return code {returncode}, see {log_path}")
+
+        try:
+            with open(stats_path, encoding="utf-8") as f:
+                all_stats.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"❌ No stats for shard {shard}:", str(e))
+
+    print("Combined stats:")
+    for key, value in sorted(combine_stats(all_stats).items()):
+        print(f"  {key}: {value}")
+    print(f"Shard logs: {workdir}")
+    record_sharded_crawl()
+
+
+def record_sharded_crawl():
+    """
+    Record a sharded crawl in crawl_runs, which bumps the data generation
+    of the API cache once for all the shards, then write its snapshot to
+    SNAPSHOT_DIR if it is set and pyarrow is installed.
+    """
+    snapshot_dir = scrapy_settings.SNAPSHOT_DIR
+    try:
+        conn = psycopg2.connect(**connection_kwargs())
+        try:
+            with conn, conn.cursor() as cur:
+                crawl_run_id = record_crawl_run(cur, "booksspider")
+            print(f"✅ Crawl recorded as run {crawl_run_id}.")
+
+            if not snapshot_dir:
+                return
+            if snapshots.pa is None:
+                print("⚠️ pyarrow is not installed, no snapshot written")
+                return
+            with conn, conn.cursor() as cur:
+                path = snapshots.write_snapshot(cur, os.path.join(SCRAPY_DIR, snapshot_dir), crawl_run_id)
+            print(f"✅ Snapshot written to {path}")
+        finally:
+            conn.close()
+
+    except Exception as e:
+        print("❌ Error recording the crawl:", str(e))
+
+
+def start_api(reload=False):
+    """
+    Start the FastAPI API with Uvicorn in a child process and return it.
+
+    The API serves the data already in the database while the crawl runs;
+    its cached responses are invalidated when the crawl is recorded.
+    The --reload mode of Uvicorn is only used if reload is True.
     """
     try:
         print("🚀 Starting the FastAPI API...")
-        subprocess.run(["uvicorn", "api.app.main:app", "--reload"])
+        command = ["uvicorn", "api.app.main:app"]
+        if reload:
+            command.append("--reload")
+        return subprocess.Popen(command, cwd=os.path.dirname(SCRAPY_DIR))
     except Exception as e:
         print("❌ Error while starting FastAPI:", e)
+        return None
+
+
+def wait_api(api):
+    """
+    Keep the API running until it stops or the user presses Ctrl+C.
+    """
+    if api is None:
+        return
+    print("✅ API available at http://localhost:8000/docs (Ctrl+C to stop)")
+    try:
+        api.wait()
+    except KeyboardInterrupt:
+        api.terminate()
+        api.wait()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the database, scrape the books and start the API.")
+    parser.add_argument("--shards", type=int, default=1, help="number of spider processes crawling in parallel")
+    parser.add_argument("--in-process", action="store_true", help="run the spider in this process instead of a child process")
+    parser.add_argument("--reload", action="store_true", help="restart the API when its code changes (development)")
+    args = parser.parse_args()
+
     print("=== Project launch ===")
     create_database()
     create_tables()
-    run_scrapy()
-    run_fastpi()
+    api = start_api(reload=args.reload)
+    if args.shards > 1:
+        run_scrapy_sharded(args.shards)
+    elif args.in_process:
+        run_scrapy_in_process()
+    else:
+        run_scrapy()
+    wait_api(api)
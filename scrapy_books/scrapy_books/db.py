@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import os
+from dotenv import load_dotenv
+
+
+def connection_kwargs():
+    """
+    Return the psycopg2 connection parameters read from the environment variables.
+    """
+    load_dotenv()
+
+    return {
+        "host": os.getenv("HOST"),
+        "database": os.getenv("DBNAME"),
+        "user": os.getenv("USER"),
+        "password": os.getenv("PASSWORD"),
+        "port": os.getenv("PORT"),
+    }
+
+
+def record_crawl_run(cursor, spider_name):
+    """
+    Insert a finished crawl into crawl_runs and return its id.
+    The new row bumps the data generation read by the API cache.
+    """
+    cursor.execute(
+        "INSERT INTO crawl_runs (spider, finished_at) VALUES (%s, now()) RETURNING id",
+        (spider_name,),
+    )
+    return cursor.fetchone()[0]
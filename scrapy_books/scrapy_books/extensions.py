@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+class StatsDump:
+    """
+    Extension writing the stats of the crawl to the JSON file named by the
+    STATS_DUMP_FILE setting when the spider closes.
+
+    It is used by run_project.py to combine the stats of the sharded crawls.
+    """
+
+    def __init__(self, stats, path):
+        self.stats = stats
+        self.path = path
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("STATS_DUMP_FILE")
+        if not path:
+            raise NotConfigured
+        ext = cls(crawler.stats, path)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_closed(self, spider, reason):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.stats.get_stats(), f, indent=2, default=str)
+
+
+class ProfileReport:
+    """
+    Extension writing the profiling stats of the crawl (see scrapy_books.profiling)
+    to the JSON file named by the PROFILE_REPORT_FILE setting when the spider closes.
+
+    For each stage, the report gives its count, total, mean and max seconds,
+    sorted by total time.
+    """
+
+    def __init__(self, stats, path):
+        self.stats = stats
+        self.path = path
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("PROFILE_REPORT_FILE")
+        if not path:
+            raise NotConfigured
+        ext = cls(crawler.stats, path)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def report(self):
+        stages = {}
+        for key, value in self.stats.get_stats().items():
+            if not key.startswith("profile/"):
+                continue
+            stage, _, measure = key[len("profile/"):].rpartition("/")
+            stages.setdefault(stage or measure, {})[measure if stage else "value"] = value
+
+        for measures in stages.values():
+            if measures.get("count"):
+                measures["mean_seconds"] = measures["seconds"] / measures["count"]
+
+        return dict(sorted(stages.items(), key=lambda stage: stage[1].get("seconds", 0), reverse=True))
+
+    def spider_closed(self, spider, reason):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+
+class SamplingProfiler:
+    """
+    Extension running the pyinstrument sampling profiler for the whole crawl
+    when the PROFILE_SAMPLER setting names an output file (.html for the
+    interactive report, any other extension for the text one).
+
+    pyinstrument is an optional dependency, only needed by this extension.
+    """
+
+    def __init__(self, path, interval):
+        from pyinstrument import Profiler
+
+        self.path = path
+        self.profiler = Profiler(interval=interval, async_mode="disabled")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("PROFILE_SAMPLER")
+        if not path:
+            raise NotConfigured
+        ext = cls(path, crawler.settings.getfloat("PROFILE_SAMPLER_INTERVAL", 0.001))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.profiler.start()
+
+    def spider_closed(self, spider, reason):
+        self.profiler.stop()
+        if self.path.endswith(".html"):
+            output = self.profiler.output_html()
+        else:
+            output = self.profiler.output_text(unicode=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(output)
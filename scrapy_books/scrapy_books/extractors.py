@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from lxml import etree
+from scrapy_books.items import BookRecord
+from scrapy_books.itemloaders import clean_price
+
+
+def has_class(name):
+    """
+    Return the XPath condition matching elements with the given CSS class.
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# XPath equivalents of the CSS selectors of BooksSpider.parse_book, compiled once
+TITLE_XPATH = etree.XPath("//h1/text()", smart_strings=False)
+PRICE_XPATH = etree.XPath(f"//*[{has_class('price_color')}]/text()", smart_strings=False)
+AVAILABILITY_XPATH = etree.XPath(
+    f"//*[{has_class('instock')} and {has_class('availability')}]/text()", smart_strings=False
+)
+DESCRIPTION_XPATH = etree.XPath(
+    "//*[@id='product_description']/following-sibling::p/text()", smart_strings=False
+)
+CATEGORY_XPATH = etree.XPath(
+    f"//*[{has_class('breadcrumb')}]//li[count(preceding-sibling::*) = 2]//a/text()", smart_strings=False
+)
+RATING_XPATH = etree.XPath(f"//p[{has_class('star-rating')}]/@class", smart_strings=False)
+UPC_XPATH = etree.XPath(
+    f"//table[{has_class('table')} and {has_class('table-striped')}]"
+    "//tr[count(preceding-sibling::*) = 0]//td/text()",
+    smart_strings=False,
+)
+
+
+def first(values, default):
+    """
+    Return the first non-empty value, or the default if there is none.
+    """
+    for value in values:
+        if value:
+            return value
+    return default
+
+
+def extract_book(response):
+    """
+    Extract the book information of a detail page into a BookRecord.
+
+    This gives the same values as the BooksInformationsLoader of
+    BooksSpider.parse_book, but evaluates precompiled XPath expressions
+    directly on the parsed document instead of translating CSS selectors
+    and running processors on every call.
+    """
+    root = response.selector.root
+
+    return BookRecord(
+        title=first(TITLE_XPATH(root), ""),
+        price=clean_price(first(PRICE_XPATH(root), "0")),
+        availability=first((text.strip() for text in AVAILABILITY_XPATH(root)), ""),
+        description=first(DESCRIPTION_XPATH(root), ""),
+        category=first(CATEGORY_XPATH(root), ""),
+        rating=first(RATING_XPATH(root), 0),
+        upc=first(UPC_XPATH(root), ""),
+    )
@@ -6,6 +6,7 @@
 # https://docs.scrapy.org/en/latest/topics/items.html
 
 import scrapy
+from dataclasses import dataclass
 
 
 class BooksInformations(scrapy.Item):
@@ -17,3 +18,32 @@ class BooksInformations(scrapy.Item):
     category = scrapy.Field()
     rating = scrapy.Field()
     upc = scrapy.Field()
+
+
+class StockRefresh(scrapy.Item):
+    """
+    Price, availability and rating of a known book, read from a listing page
+    by the refresh mode of the spider.
+    """
+    upc = scrapy.Field()
+    price = scrapy.Field()
+    availability = scrapy.Field()
+    stock_count = scrapy.Field()
+    rating = scrapy.Field()
+
+
+@dataclass(slots=True)
+class BookRecord:
+    """
+    Compact item with the same fields as BooksInformations, emitted by the
+    fast extractor. The defaults are the values BooksSpider.parse_book sets
+    for the fields missing from the page, so both extractors give the same rows.
+    """
+    title: str = ""
+    price: float = 0.0
+    availability: str = ""
+    stock_count: int = 0
+    description: str = ""
+    category: str = ""
+    rating: str | int = 0
+    upc: str = ""
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+from scrapy_books.db import connection_kwargs
+
+
+Page = namedtuple("Page", ["upc", "last_seen", "etag", "last_modified"])
+
+
+class PageStore:
+    """
+    Persistent store of the book detail pages already crawled.
+
+    For each URL it keeps the UPC of the book, the last time the page was
+    fetched or revalidated, and the ETag/Last-Modified validators sent by
+    the server. The store is loaded once when the spider opens and the
+    changes are written back in one statement when it closes.
+
+    Only the pages of books stored in the books table are known: a page
+    whose item was never written must be downloaded again.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.updates = {}
+
+    def load(self):
+        """
+        Load all the known pages from the pages table.
+        """
+        conn = psycopg2.connect(**connection_kwargs())
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT p.url, p.upc, p.last_seen, p.etag, p.last_modified
+                    FROM pages p
+                    WHERE EXISTS (SELECT 1 FROM books b WHERE b.upc = p.upc)
+                """)
+                self.pages = {url: Page(*row) for url, *row in cur}
+        finally:
+            conn.close()
+
+    def get(self, url):
+        """
+        Return the Page stored for the given URL, or None if it was never crawled.
+        """
+        return self.pages.get(url)
+
+    def is_fresh(self, url, max_age):
+        """
+        Return True if the page was fetched or revalidated less than max_age seconds ago.
+        """
+        page = self.pages.get(url)
+        if page is None or page.last_seen is None:
+            return False
+        return datetime.now(timezone.utc) - page.last_seen < timedelta(seconds=max_age)
+
+    def record(self, url, upc, etag=None, last_modified=None):
+        """
+        Record that the page was fetched now, with its UPC and validators.
+        """
+        page = Page(upc, datetime.now(timezone.utc), etag, last_modified)
+        self.pages[url] = self.updates[url] = page
+
+    def touch(self, url):
+        """
+        Record that a known page was revalidated now and did not change.
+        """
+        page = self.pages[url]._replace(last_seen=datetime.now(timezone.utc))
+        self.pages[url] = self.updates[url] = page
+
+    def forget(self, upc):
+        """
+        Forget the pages recorded or touched during this crawl for the book
+        with the given UPC, whose item could not be written.
+        """
+        for url in [url for url, page in self.updates.items() if page.upc == upc]:
+            del self.updates[url]
+            del self.pages[url]
+
+    def save(self):
+        """
+        Upsert all the pages recorded or touched since the store was loaded,
+        except those of books missing from the books table (items dropped or
+        not written).
+        """
+        if not self.updates:
+            return
+
+        conn = psycopg2.connect(**connection_kwargs())
+        try:
+            with conn, conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO pages (url, upc, last_seen, etag, last_modified)
+                    SELECT v.url, v.upc, v.last_seen::timestamptz, v.etag, v.last_modified
+                    FROM (VALUES %s) AS v (url, upc, last_seen, etag, last_modified)
+                    WHERE EXISTS (SELECT 1 FROM books b WHERE b.upc = v.upc)
+                    ON CONFLICT (url) DO UPDATE SET
+                        upc = EXCLUDED.upc,
+                        last_seen = EXCLUDED.last_seen,
+                        etag = EXCLUDED.etag,
+                        last_modified = EXCLUDED.last_modified
+                """, [(url, *page) for url, page in self.updates.items()])
+            self.updates = {}
+        finally:
+            conn.close()
@@ -8,12 +8,22 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy import Item
 import re
-import psycopg2
-import os
-from dotenv import load_dotenv
+import hashlib
+import time
+from psycopg2.extras import execute_values
+from twisted.enterprise import adbapi
+from twisted.internet import defer, task
+from scrapy_books.db import connection_kwargs, record_crawl_run
+from scrapy_books.items import StockRefresh
+from scrapy_books import snapshots
+from scrapy_books.profiling import profiled, record_timing
 
-load_dotenv()
+
+# Signal sent by SavingToPostgresPipeline for each item it could not write,
+# with the item and spider arguments (see BooksSpider.item_not_written)
+item_not_written = object()
 
 
 class ScrapyBooksPipeline:
@@ -25,162 +35,607 @@ class ScrapyBooksPipeline:
         return item
 
 
-class ConvertRatingPipeline:
+WHITESPACE_RE = re.compile(r"\s+")
+NON_PRINTABLE_RE = re.compile(r"[^\x20-\x7E]+")
+STOCK_COUNT_RE = re.compile(r"\((\d+)\s+available\)")
+RATING_MAP = {"One": 1, "Two": 2, "Three": 3, "Four": 4, "Five": 5}
+
+
+def convert_rating(item):
+    """
+    Convert the rating of the book to a numerical value.
+
+    The last word of the rating string is used as the key to get the
+    numerical value from RATING_MAP. If the rating is not found in the
+    dictionary, it defaults to 0. A rating that is already a number (such
+    as the 0 set by the spider when the page has none) is kept as an int.
+    """
+    rating = item.get("rating", "")
+    if not isinstance(rating, str):
+        item["rating"] = int(rating or 0)
+        return item
+
+    rating_words = rating.split()
+    item["rating"] = RATING_MAP.get(rating_words[-1] if rating_words else "", 0)
+    return item
+
+
+def normalize_availability(item):
+    """
+    Normalize the availability of the book to "In stock" or "Out of stock".
+    If the book is "In stock", the available stock count is extracted from
+    the availability text and stored in stock_count.
+    """
+    availability_text = item.get("availability", "").strip()
+
+    item["availability"] = "Out of stock"
+    item["stock_count"] = 0
+
+    if "In stock" in availability_text:
+        item["availability"] = "In stock"
+
+        match = STOCK_COUNT_RE.search(availability_text)
+        if match:
+            item["stock_count"] = int(match.group(1))
+
+    return item
+
+
+def clean_description(item):
+    """
+    Clean the description of the book by replacing multiple spaces with a single space and removing all non-ASCII characters.
+    """
+    desc = item.get("description", "")
+    if desc:
+        desc = WHITESPACE_RE.sub(" ", desc)
+        desc = NON_PRINTABLE_RE.sub("", desc)
+        item["description"] = desc.strip()
+    return item
+
+
+def as_mapping(item):
+    """
+    Return item itself if it supports item["field"] and item.get(), or an
+    ItemAdapter around it otherwise (dataclass items such as BookRecord).
+    """
+    if isinstance(item, (dict, Item)):
+        return item
+    return ItemAdapter(item)
+
+
+class NormalizeItemPipeline:
+    @profiled
     def process_item(self, item, spider):
         """
         Process the item and return it, or raise an exception if
         the item should be dropped.
 
-        This pipeline takes the rating of the book and converts it to a
-        numerical value. The rating is extracted from the item and the last
-        word of the rating string is used as the key to get the numerical
-        value from the rating_map dictionary. If the rating is not found in
-        the dictionary, it defaults to 0.
+        This pipeline applies all the normalizations of the book in one
+        stage: the description is cleaned, the availability is split into
+        a status and a stock count, and the rating is converted to a number.
+        It replaces the chain of CleanTextPipeline, AvailabilityPipeline and
+        ConvertRatingPipeline.
+
+        The normalization functions work on any mapping: scrapy.Item and dict
+        items are used as they are, and the dataclass items through an
+        ItemAdapter, which is only built for them since it costs more than
+        the normalization itself.
+        """
+        adapter = as_mapping(item)
+        clean_description(adapter)
+        normalize_availability(adapter)
+        convert_rating(adapter)
+        return item
+
+
+class ConvertRatingPipeline:
+    @profiled
+    def process_item(self, item, spider):
         """
-        rating_map = {"One":1, "Two":2, "Three":3, "Four":4, "Five":5}
-        rating_word = item.get("rating", "").split()[-1]
-        item["rating"] = rating_map.get(rating_word, 0)
+        Convert the rating of the book to a numerical value.
+        Kept for compatibility, see NormalizeItemPipeline.
+        """
+        convert_rating(as_mapping(item))
         return item
     
 
 class AvailabilityPipeline:
+    @profiled
     def process_item(self, item, spider):
         """
-        Process the item and return it, or raise an exception if
-        the item should be dropped.
-
-        This pipeline checks the availability of the book and updates the
-        item accordingly. If the book is "In stock", it extracts the
-        available stock count from the availability text and updates the
-        item with the count.
+        Normalize the availability of the book and extract its stock count.
+        Kept for compatibility, see NormalizeItemPipeline.
         """
-        availability_text = item.get("availability", "").strip()
-
-        item["availability"] = "Out of stock"
-        item["stock_count"] = 0
-
-        if availability_text:
-            if "In stock" in availability_text:
-                item["availability"] = "In stock"
-
-                match = re.search(r"\((\d+)\s+available\)", availability_text)
-                if match:
-                    item["stock_count"] = int(match.group(1))
-
+        normalize_availability(as_mapping(item))
         return item
     
 
 class CleanTextPipeline:
+    @profiled
     def process_item(self, item, spider):
         """
-        Clean the description of the book by replacing multiple spaces with a single space and removing all non-ASCII characters.
+        Clean the description of the book.
+        Kept for compatibility, see NormalizeItemPipeline.
         """
-        desc = item.get("description", "")
-        if desc:
-            desc = re.sub(r'\s+', ' ', desc)
-            desc = re.sub(r'[^\x20-\x7E]+', '', desc)
-            item["description"] = desc.strip()
+        clean_description(as_mapping(item))
         return item
     
 
+def book_fingerprint(item):
+    """
+    Return a hash of the normalized fields of a book item.
+
+    Two items with the same fingerprint would write exactly the same rows,
+    so the fingerprint is used to detect books that did not change since
+    the last crawl.
+    """
+    fields = (
+        item.get("title", "Unknown"),
+        item.get("description", ""),
+        str(item.get("rating", 0)),
+        item.get("category", ""),
+        f"{float(item.get('price', 0.0)):.2f}",
+        item.get("availability", ""),
+        str(item.get("stock_count", 0)),
+    )
+    return hashlib.blake2b("\x1f".join(fields).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def stock_state(price, availability, rating):
+    """
+    Return the comparable state of the stock of a book, as updated by the refresh mode.
+    """
+    return (f"{float(price or 0.0):.2f}", availability, rating)
+
+
 class SavingToPostgresPipeline(object):
 
-    def __init__(self):
+    def __init__(self, batch_size=1, batch_interval=0, pool_size=4, snapshot_dir="", record_crawl=True):
         """
-        Initialize the pipeline by creating a connection to the PostgreSQL database.
+        Initialize the pipeline by creating a pool of connections to the PostgreSQL database.
+
+        Items are buffered and written in a single transaction once batch_size items
+        are waiting or batch_interval seconds have passed since the last flush.
+        A batch_size of 1 writes every item as soon as it arrives.
+
+        The writes run in the worker threads of the pool, never on the reactor
+        thread, and at most pool_size of them run at the same time.
+
+        If snapshot_dir is set, a Parquet snapshot of the catalogue is written
+        there when the spider closes (see scrapy_books.snapshots).
+
+        If record_crawl is False, the crawl is neither recorded in crawl_runs
+        nor snapshotted: a sharded crawl does it once, when all the shards
+        are finished (see run_project.py).
         """
+        self.batch_size = max(batch_size, 1)
+        self.batch_interval = batch_interval
+        self.pool_size = max(pool_size, 1)
+        self.snapshot_dir = snapshot_dir
+        self.record_crawl = record_crawl
+        self.buffer = []
+        self.fingerprints = {}
+        self.stocks = {}
+        self.touched = set()
+        self.pending = set()
+        self.write_slots = defer.DeferredSemaphore(self.pool_size)
+        self.flush_loop = None
+        self.crawl_run_id = None
+        self.stats = None
+        self.spider = None
         self.create_connection()
 
-    def create_connection(self):
+    @classmethod
+    def from_crawler(cls, crawler):
         """
-        Create a connection to the PostgreSQL database.
-        The connection and cursor are stored as instance variables self.conn and self.cur respectively.
+        Build the pipeline from the POSTGRES_BATCH_SIZE, POSTGRES_BATCH_INTERVAL,
+        POSTGRES_POOL_SIZE, SNAPSHOT_DIR and RECORD_CRAWL_RUN settings.
         """
-        load_dotenv()
+        return cls(
+            batch_size=crawler.settings.getint("POSTGRES_BATCH_SIZE", 1),
+            batch_interval=crawler.settings.getfloat("POSTGRES_BATCH_INTERVAL", 0),
+            pool_size=crawler.settings.getint("POSTGRES_POOL_SIZE", 4),
+            snapshot_dir=crawler.settings.get("SNAPSHOT_DIR", ""),
+            record_crawl=crawler.settings.getbool("RECORD_CRAWL_RUN", True),
+        )
 
+    def create_connection(self):
+        """
+        Create the pool of connections to the PostgreSQL database.
+        The pool is stored as the instance variable self.dbpool.
+        """
         try:
-            self.conn = psycopg2.connect(
-                host=os.getenv("HOST"),
-                database=os.getenv("DBNAME"),
-                user=os.getenv("USER"),
-                password=os.getenv("PASSWORD"),
-                port=os.getenv("PORT")
+            self.dbpool = adbapi.ConnectionPool(
+                "psycopg2",
+                cp_min=1,
+                cp_max=self.pool_size,
+                cp_reconnect=True,
+                **connection_kwargs()
             )
-            self.cur = self.conn.cursor()
         except Exception as e:
             print(f"Error connecting to database: {str(e)}")
             raise e
 
 
+    def open_spider(self, spider):
+        """
+        Start the timer that flushes the buffer every batch_interval seconds,
+        and preload the fingerprints of the books already in the database.
+        In refresh mode, the latest stock state of every book is preloaded too.
+        """
+        self.stats = spider.crawler.stats
+        self.spider = spider
+        if self.batch_interval:
+            self.flush_loop = task.LoopingCall(self.flush)
+            self.flush_loop.start(self.batch_interval, now=False)
+
+        d = self.dbpool.runQuery("SELECT upc, fingerprint FROM books WHERE fingerprint IS NOT NULL")
+        d.addCallback(self.fingerprints.update)
+        loads = [d]
+
+        if getattr(spider, "mode", None) == "refresh":
+            d = self.dbpool.runQuery("""
+                SELECT b.upc, s.price, s.availability, b.rating
+                FROM books b
+                JOIN stocks s ON s.book_id = b.id
+            """)
+            d.addCallback(lambda rows: self.stocks.update(
+                (upc, stock_state(price, availability, rating)) for upc, price, availability, rating in rows
+            ))
+            loads.append(d)
+
+        return defer.DeferredList(loads, fireOnOneErrback=True)
+
+
+    @profiled
     def process_item(self, item, spider):
         """
-        Process the item and store it in the PostgreSQL database.
+        Buffer the item and flush the buffer to the PostgreSQL database
+        when the size threshold is reached.
+
+        Items whose fingerprint matches the one stored for their UPC did not
+        change since the last crawl and are not written at all. The same goes
+        for StockRefresh items whose stock state did not change.
+
+        While pool_size batches are waiting or being written, the returned
+        Deferred only fires once one of them is committed, so Scrapy stops
+        feeding new items until a connection of the pool is free again.
         """
-        self.store_db(item)
+        adapter = as_mapping(item)
+        upc = adapter.get("upc", "")
+
+        if isinstance(item, StockRefresh):
+            state = stock_state(adapter["price"], adapter["availability"], adapter["rating"])
+            if self.stocks.get(upc) == state:
+                spider.crawler.stats.inc_value("postgres/refreshes_unchanged")
+                return item
+            self.stocks[upc] = state
+            # The refreshed stock no longer matches the fingerprint of the book
+            self.fingerprints.pop(upc, None)
+        else:
+            fingerprint = book_fingerprint(adapter)
+            if self.fingerprints.get(upc) == fingerprint:
+                spider.crawler.stats.inc_value("postgres/items_unchanged")
+                return item
+            self.fingerprints[upc] = fingerprint
+
+        self.touched.add(upc)
+        self.buffer.append(adapter)
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        if len(self.pending) >= self.pool_size:
+            d = defer.DeferredList(list(self.pending), fireOnOneCallback=True, consumeErrors=True)
+            d.addCallback(lambda _: item)
+            return d
         return item
-    
 
-    def store_db(self, item):
+
+    def flush(self):
+        """
+        Write all buffered items in one transaction, in a worker thread of the pool.
+
+        At most pool_size batches are handed to the pool at a time: the next
+        ones wait in self.write_slots, not in the unbounded queue of adbapi.
+
+        The fingerprints and stock states of the items that could not be
+        written are forgotten, so that they are written if they come again.
+
+        Returns a Deferred that fires when the batch is committed.
+        """
+        items, self.buffer = self.buffer, []
+        if not items:
+            return defer.succeed(None)
+
+        started = time.perf_counter()
+        d = self.write_slots.run(self.dbpool.runInteraction, self.store_items, items)
+        d.addCallback(self.record_commit, len(items), started)
+        d.addCallback(self.forget_items)
+        d.addErrback(self.batch_failed, items)
+
+        self.pending.add(d)
+        d.addBoth(lambda result: self.pending.discard(d) or result)
+        return d
+
+
+    def record_commit(self, failed, count, started):
+        """
+        Record the latency of a committed batch, from the flush to the commit
+        (including the wait for a free connection), and its number of items written.
+        """
+        if self.stats is not None:
+            record_timing(self.stats, "db/commit", time.perf_counter() - started)
+            self.stats.inc_value("profile/db/items_written", count - len(failed))
+        return failed
+
+
+    def forget_items(self, items):
+        """
+        Forget the fingerprints and stock states recorded for items that were not
+        written, and send the item_not_written signal for each of them.
+        """
+        for item in items:
+            if isinstance(item.item, StockRefresh):
+                self.stocks.pop(item.get("upc", ""), None)
+            else:
+                self.fingerprints.pop(item.get("upc", ""), None)
+            if self.spider is not None:
+                self.spider.crawler.signals.send_catch_log(item_not_written, item=item.item, spider=self.spider)
+
+
+    def batch_failed(self, failure, items):
+        print(f"❌ Error committing batch: {failure.getErrorMessage()}")
+        self.forget_items(items)
+
+
+    def store_items(self, cursor, items):
         """
-        Store the item in the PostgreSQL database.
+        Store a list of items in the current transaction.
 
-        The item is first inserted into the categories table, and then
-        inserted into the books table. If the item already exists in
-        either table, the existing item is updated with the new data.
+        The whole batch is first written with multi-row statements inside a
+        savepoint. If that fails, the savepoint is rolled back and the items
+        are written one by one, each in its own savepoint, so a single bad
+        row only loses itself and not the rest of the batch.
 
-        Finally, the item is inserted into the stocks table with the
-        id of the book in the books table.
+        The transaction is committed by the pool when this method returns.
+        Returns the list of the items that could not be written.
         """
         try:
-            self.cur.execute("""
-                INSERT INTO categories (name) VALUES (%s)
-                ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
-                RETURNING id
-            """, (item['category'],))
-            category_id = self.cur.fetchone()[0]
-
-            description = item.get("description", "")
-            self.cur.execute("""
-                INSERT INTO books (upc, title, description, category_id, rating)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (upc) DO UPDATE SET
-                    title = EXCLUDED.title,
-                    description = EXCLUDED.description,
-                    category_id = EXCLUDED.category_id,
-                    rating = EXCLUDED.rating
-                RETURNING id
-            """,  (
-                    item.get("upc", ""),
-                    item.get("title", "Unknown"),
-                    description,
-                    category_id,
-                    item.get("rating", 0)
-                ))
-            book_id = self.cur.fetchone()[0]
+            cursor.execute("SAVEPOINT batch")
+            self.store_batch(cursor, items)
+            cursor.execute("RELEASE SAVEPOINT batch")
+            return []
+        except Exception as e:
+            print(f"⚠️ Error saving batch of {len(items)} items, retrying one by one: {str(e)}")
+            cursor.execute("ROLLBACK TO SAVEPOINT batch")
+            return [item for item in items if not self.store_db(cursor, item)]
 
-            self.cur.execute("""
-                INSERT INTO stocks (book_id, price, availability, stock_count)
-                VALUES (%s, %s, %s, %s)
-            """, (
-                book_id,
-                item['price'],
-                item['availability'],
-                item['stock_count']
-            ))
 
-            self.conn.commit()
-        
+    def store_db(self, cursor, item):
+        """
+        Store a single item in the current transaction.
+
+        The write happens inside a savepoint: if it fails, only this item
+        is rolled back and the transaction stays usable for the others.
+        Returns True if the item was written.
+        """
+        try:
+            cursor.execute("SAVEPOINT item")
+            self.store_batch(cursor, [item])
+            cursor.execute("RELEASE SAVEPOINT item")
+            return True
         except Exception as e:
             print(f"❌ Error saving item: {str(e)}")
-            self.conn.rollback()
+            cursor.execute("ROLLBACK TO SAVEPOINT item")
+            return False
+
+
+    def store_batch(self, cursor, items):
+        """
+        Store a list of items with one multi-row statement per table.
+
+        The categories are upserted first, and then the books. If a row
+        already exists in either table, it is updated with the new data.
+        Books are deduplicated on UPC because a single upsert statement
+        cannot update the same row twice. Their fingerprint is stored with
+        them for the change detection of the next crawls.
+
+        Finally, the current stock of each book is upserted into the stocks
+        table, and the stocks that actually changed are appended to the
+        stock_history table in the same statement.
+
+        StockRefresh items are written separately by store_refreshes().
+        """
+        refreshes = [item for item in items if isinstance(item.item, StockRefresh)]
+        if refreshes:
+            self.store_refreshes(cursor, refreshes)
+            items = [item for item in items if not isinstance(item.item, StockRefresh)]
+            if not items:
+                return
+
+        categories = sorted({item["category"] for item in items})
+        category_ids = dict(execute_values(cursor, """
+            INSERT INTO categories (name) VALUES %s
+            ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+            RETURNING name, id
+        """, [(name,) for name in categories], page_size=len(categories), fetch=True))
+
+        books = {item.get("upc", ""): item for item in items}
+        book_ids = dict(execute_values(cursor, """
+            INSERT INTO books (upc, title, description, category_id, rating, fingerprint)
+            VALUES %s
+            ON CONFLICT (upc) DO UPDATE SET
+                title = EXCLUDED.title,
+                description = EXCLUDED.description,
+                category_id = EXCLUDED.category_id,
+                rating = EXCLUDED.rating,
+                fingerprint = EXCLUDED.fingerprint
+            RETURNING upc, id
+        """, [
+                (
+                    upc,
+                    item.get("title", "Unknown"),
+                    item.get("description", ""),
+                    category_ids[item["category"]],
+                    item.get("rating", 0),
+                    book_fingerprint(item)
+                )
+                for upc, item in sorted(books.items())
+            ], page_size=len(books), fetch=True))
+
+        execute_values(cursor, """
+            WITH changed AS (
+                INSERT INTO stocks (book_id, price, availability, stock_count)
+                VALUES %s
+                ON CONFLICT (book_id) DO UPDATE SET
+                    price = EXCLUDED.price,
+                    availability = EXCLUDED.availability,
+                    stock_count = EXCLUDED.stock_count,
+                    updated_at = now()
+                WHERE (stocks.price, stocks.availability, stocks.stock_count)
+                    IS DISTINCT FROM (EXCLUDED.price, EXCLUDED.availability, EXCLUDED.stock_count)
+                RETURNING book_id, price, availability, stock_count
+            )
+            INSERT INTO stock_history (book_id, price, availability, stock_count)
+            SELECT book_id, price, availability, stock_count FROM changed
+        """, [
+                (
+                    book_ids[upc],
+                    item['price'],
+                    item['availability'],
+                    item['stock_count']
+                )
+                for upc, item in sorted(books.items())
+            ], page_size=len(books))
+
+
+    def store_refreshes(self, cursor, items):
+        """
+        Store a list of StockRefresh items.
+
+        The current stock of each known book is updated in place with the
+        price and availability read on the listing page, and the change is
+        appended to stock_history. The listing does not show the stock count,
+        so the previous one is kept while the book is in stock. The rating of
+        the books is updated as well.
+
+        The fingerprint of the refreshed books no longer describes their
+        stored rows, so it is cleared: the next full crawl writes them again.
+        """
+        rows = sorted(
+            {item["upc"]: (item["upc"], item["price"], item["availability"], item["rating"]) for item in items}.values()
+        )
+
+        execute_values(cursor, """
+            WITH changed AS (
+                UPDATE stocks SET
+                    price = v.price::numeric(6, 2),
+                    availability = v.availability,
+                    stock_count = CASE WHEN v.availability = 'In stock' THEN stocks.stock_count ELSE 0 END,
+                    updated_at = now()
+                FROM (VALUES %s) AS v (upc, price, availability, rating)
+                JOIN books b ON b.upc = v.upc
+                WHERE stocks.book_id = b.id
+                    AND (stocks.price, stocks.availability) IS DISTINCT FROM (v.price::numeric(6, 2), v.availability)
+                RETURNING stocks.book_id, stocks.price, stocks.availability, stocks.stock_count
+            )
+            INSERT INTO stock_history (book_id, price, availability, stock_count)
+            SELECT book_id, price, availability, stock_count FROM changed
+        """, rows, page_size=len(rows))
+
+        execute_values(cursor, """
+            UPDATE books SET rating = v.rating, fingerprint = NULL
+            FROM (VALUES %s) AS v (upc, price, availability, rating)
+            WHERE books.upc = v.upc
+                AND (books.rating IS DISTINCT FROM v.rating OR books.fingerprint IS NOT NULL)
+        """, rows, page_size=len(rows))
+
+
+    def close_spider(self, spider):
+        """
+        Flush the remaining buffered items, wait for all pending writes,
+        refresh the category_stats summary, record the crawl in crawl_runs,
+        write its snapshot and close the connection pool.
+
+        The new crawl_runs row bumps the data generation, which invalidates
+        the responses cached by the API. Nothing is recorded nor snapshotted
+        if record_crawl is False.
+        """
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+
+        self.flush()
+        d = defer.DeferredList(list(self.pending))
+        d.addCallback(lambda _: self.dbpool.runInteraction(self.refresh_category_stats, sorted(self.touched)))
+        if self.record_crawl:
+            d.addCallback(lambda _: self.dbpool.runInteraction(record_crawl_run, spider.name))
+            d.addCallback(lambda crawl_run_id: setattr(self, "crawl_run_id", crawl_run_id))
+        d.addErrback(lambda failure: print(f"❌ Error recording the crawl: {failure.getErrorMessage()}"))
+        d.addCallback(lambda _: self.write_snapshot())
+        d.addErrback(lambda failure: print(f"❌ Error writing the snapshot: {failure.getErrorMessage()}"))
+        d.addBoth(lambda _: self.close_connection(spider))
+        return d
+
+
+    def refresh_category_stats(self, cursor, upcs):
+        """
+        Recompute the category_stats rows of the categories of the books
+        written during this crawl, or of all the categories if the table is
+        still empty. The price of a book is the one of its current stock.
+
+        A book moved to another category leaves its previous category with
+        one book less than its stored book_count: the categories whose count
+        no longer matches are recomputed too, and the rows of the categories
+        left without any book are deleted.
+        """
+        cursor.execute("""
+            DELETE FROM category_stats cs
+            WHERE NOT EXISTS (SELECT 1 FROM books b WHERE b.category_id = cs.category_id)
+        """)
+        cursor.execute("""
+            INSERT INTO category_stats (
+                category_id, book_count, priced_count, avg_price,
+                min_price, max_price, avg_rating, refreshed_at
+            )
+            SELECT b.category_id, count(*), count(s.price), avg(s.price),
+                min(s.price), max(s.price), avg(b.rating), now()
+            FROM books b
+            LEFT JOIN stocks s ON s.book_id = b.id
+            WHERE b.category_id IN (SELECT category_id FROM books WHERE upc = ANY(%s))
+                OR b.category_id IN (
+                    SELECT cs.category_id FROM category_stats cs
+                    WHERE cs.book_count <> (SELECT count(*) FROM books WHERE category_id = cs.category_id)
+                )
+                OR NOT EXISTS (SELECT 1 FROM category_stats)
+            GROUP BY b.category_id
+            ON CONFLICT (category_id) DO UPDATE SET
+                book_count = EXCLUDED.book_count,
+                priced_count = EXCLUDED.priced_count,
+                avg_price = EXCLUDED.avg_price,
+                min_price = EXCLUDED.min_price,
+                max_price = EXCLUDED.max_price,
+                avg_rating = EXCLUDED.avg_rating,
+                refreshed_at = EXCLUDED.refreshed_at
+        """, (upcs,))
+
+
+    def write_snapshot(self):
+        """
+        Write the snapshot of the recorded crawl in a worker thread of the pool.
+        Does nothing if SNAPSHOT_DIR is empty or the crawl was not recorded.
+        """
+        if not self.snapshot_dir or self.crawl_run_id is None:
+            return None
+        if snapshots.pa is None:
+            print("⚠️ pyarrow is not installed, no snapshot written")
+            return None
+        d = self.dbpool.runInteraction(snapshots.write_snapshot, self.snapshot_dir, self.crawl_run_id)
+        d.addCallback(lambda path: print(f"✅ Snapshot written to {path}"))
+        return d
 
-        return item
-    
 
     def close_connection(self, spider):
         """
-        Close the connection to the PostgreSQL database after the spider has finished its work.
+        Close the connection pool after the spider has finished its work.
         """
-        self.cur.close()
-        self.conn.close()
-    
\ No newline at end of file
+        self.dbpool.close()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from scrapy.exceptions import NotConfigured
+
+
+# Named crawl profiles, selected from the command line with:
+#     scrapy crawl booksspider -s CRAWL_PROFILE=balanced
+# AutoThrottle adapts the delay of each profile to the observed latency,
+# DOWNLOAD_DELAY being the lowest delay it may reach, and BackoffMiddleware
+# slows down on 429/5xx answers and network errors.
+PROFILES = {
+    "polite": {
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
+        "DOWNLOAD_DELAY": 1,
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 1,
+        "AUTOTHROTTLE_MAX_DELAY": 60,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 1.0,
+    },
+    "balanced": {
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 8,
+        "DOWNLOAD_DELAY": 0.25,
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 0.5,
+        "AUTOTHROTTLE_MAX_DELAY": 30,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 4.0,
+    },
+    "aggressive": {
+        "CONCURRENT_REQUESTS": 32,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 32,
+        "DOWNLOAD_DELAY": 0,
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 0.1,
+        "AUTOTHROTTLE_MAX_DELAY": 10,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 16.0,
+    },
+}
+
+
+class CrawlProfile:
+    """
+    Add-on applying the settings of the profile named by CRAWL_PROFILE.
+
+    The profile settings have the "addon" priority, so they override the
+    defaults but not a value given explicitly with -s on the command line.
+    """
+
+    def update_settings(self, settings):
+        name = settings.get("CRAWL_PROFILE", "polite")
+        if name not in PROFILES:
+            raise ValueError(f"Unknown CRAWL_PROFILE {name!r}, expected one of: {', '.join(PROFILES)}")
+        settings.setdict(PROFILES[name], priority="addon")
+
+
+class BackoffMiddleware:
+    """
+    Downloader middleware slowing down the download slot of a site that
+    answers with an error status (429, 5xx) or fails at the network level.
+
+    The delay of the slot is doubled on each error, or set to the
+    Retry-After value sent by the server, up to AUTOTHROTTLE_MAX_DELAY.
+    AutoThrottle then brings it back down as successful responses arrive.
+    """
+
+    def __init__(self, crawler, http_codes, max_delay):
+        self.crawler = crawler
+        self.http_codes = set(http_codes)
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("BACKOFF_ENABLED"):
+            raise NotConfigured
+        return cls(
+            crawler,
+            http_codes=crawler.settings.getlist("BACKOFF_HTTP_CODES"),
+            max_delay=crawler.settings.getfloat("AUTOTHROTTLE_MAX_DELAY", 60),
+        )
+
+    def process_response(self, request, response, spider):
+        if response.status in self.http_codes:
+            self.backoff(request, response.headers.get("Retry-After"))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.backoff(request)
+        return None
+
+    def backoff(self, request, retry_after=None):
+        """
+        Increase the delay of the download slot of the request.
+        """
+        slot = self.crawler.engine.downloader.slots.get(request.meta.get("download_slot"))
+        if slot is None:
+            return
+
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = max(slot.delay * 2, 1.0)
+
+        slot.delay = min(delay, self.max_delay)
+        self.crawler.stats.inc_value("backoff/count")
+        self.crawler.stats.max_value("backoff/max_delay", slot.delay)
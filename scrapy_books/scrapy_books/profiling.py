@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight profiling of the crawl, recorded in the Scrapy stats.
+
+Every timed stage gets three stats under the "profile/" prefix:
+profile/<stage>/count, profile/<stage>/seconds (total) and
+profile/<stage>/max_seconds. The stages are:
+
+- download: download latency of the responses (from the download_latency meta)
+- callback/<name>: time spent in each spider callback (CallbackProfiler)
+- pipeline/<name>: time spent in process_item of each pipeline (@profiled)
+- db/commit: latency of the batched writes of SavingToPostgresPipeline,
+  from the flush to the commit, with profile/db/items_written
+
+The stats are written to PROFILE_REPORT_FILE by extensions.ProfileReport.
+"""
+
+import functools
+import time
+
+
+def record_timing(stats, stage, elapsed):
+    """
+    Add one measure of elapsed seconds to the stats of stage.
+    """
+    stats.inc_value(f"profile/{stage}/count")
+    stats.inc_value(f"profile/{stage}/seconds", elapsed, start=0.0)
+    stats.max_value(f"profile/{stage}/max_seconds", elapsed)
+
+
+def profiled(process_item):
+    """
+    Decorator timing the process_item method of a pipeline under
+    profile/pipeline/<class name>.
+
+    Only the synchronous part of the method is timed: when it returns a
+    Deferred, the time spent waiting for it is not included. Nothing is
+    recorded when the spider is not attached to a crawler (e.g. in the
+    offline benchmarks, which pass None).
+    """
+    @functools.wraps(process_item)
+    def wrapper(self, item, spider):
+        stats = getattr(getattr(spider, "crawler", None), "stats", None)
+        if stats is None:
+            return process_item(self, item, spider)
+
+        start = time.perf_counter()
+        try:
+            return process_item(self, item, spider)
+        finally:
+            record_timing(stats, f"pipeline/{type(self).__name__}", time.perf_counter() - start)
+
+    return wrapper
+
+
+class CallbackProfiler:
+    """
+    Spider middleware timing the spider callbacks under profile/callback/<name>,
+    and recording the download latency of their responses under profile/download.
+
+    The time of a callback is the time spent producing its results, so it
+    must be the closest middleware to the spider (highest order) to exclude
+    the other middlewares.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_spider_input(self, response, spider):
+        latency = response.meta.get("download_latency")
+        if latency is not None:
+            record_timing(self.stats, "download", latency)
+
+    def stage(self, response, spider):
+        callback = response.request.callback or spider.parse
+        return f"callback/{getattr(callback, '__name__', 'parse')}"
+
+    def process_spider_output(self, response, result, spider):
+        stage = self.stage(response, spider)
+        elapsed = 0.0
+        start = time.perf_counter()
+        for output in result:
+            elapsed += time.perf_counter() - start
+            yield output
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+        record_timing(self.stats, stage, elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        stage = self.stage(response, spider)
+        elapsed = 0.0
+        start = time.perf_counter()
+        async for output in result:
+            elapsed += time.perf_counter() - start
+            yield output
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+        record_timing(self.stats, stage, elapsed)
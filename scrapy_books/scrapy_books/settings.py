@@ -12,7 +12,13 @@ BOT_NAME = "scrapy_books"
 SPIDER_MODULES = ["scrapy_books.spiders"]
 NEWSPIDER_MODULE = "scrapy_books.spiders"
 
-ADDONS = {}
+ADDONS = {
+    "scrapy_books.profiles.CrawlProfile": 0,
+}
+
+# Crawl profile applied by the CrawlProfile add-on: polite, balanced or aggressive.
+# Select another one from the command line: scrapy crawl booksspider -s CRAWL_PROFILE=balanced
+CRAWL_PROFILE = "polite"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -21,10 +27,15 @@ ADDONS = {}
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
-# Concurrency and throttling settings
+# Concurrency and throttling settings come from the crawl profile
+# (see scrapy_books/profiles.py): setting them here would override every profile
 #CONCURRENT_REQUESTS = 16
-CONCURRENT_REQUESTS_PER_DOMAIN = 1
-DOWNLOAD_DELAY = 1
+#CONCURRENT_REQUESTS_PER_DOMAIN = 1
+#DOWNLOAD_DELAY = 1
+
+# Slow down the download slot on these answers or on network errors
+BACKOFF_ENABLED = True
+BACKOFF_HTTP_CODES = [429, 500, 502, 503, 504]
 
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
@@ -38,33 +49,72 @@ DOWNLOAD_DELAY = 1
 #    "Accept-Language": "en",
 #}
 
+# Incremental mode (scrapy crawl booksspider -a mode=incremental): book pages
+# fetched less than INCREMENTAL_MAX_AGE seconds ago are not downloaded again
+INCREMENTAL_MAX_AGE = 86400
+
+# Extract book pages with the precompiled XPath expressions of
+# scrapy_books.extractors into compact BookRecord items
+FAST_EXTRACTOR = False
+
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    "scrapy_books.middlewares.ScrapyBooksSpiderMiddleware": 543,
-#}
+    # Closest to the spider, so that only the callbacks are timed
+    "scrapy_books.profiling.CallbackProfiler": 1000,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
+DOWNLOADER_MIDDLEWARES = {
 #    "scrapy_books.middlewares.ScrapyBooksDownloaderMiddleware": 543,
-#}
+    "scrapy_books.profiles.BackoffMiddleware": 560,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "scrapy_books.extensions.StatsDump": 500,
+    "scrapy_books.extensions.ProfileReport": 500,
+    "scrapy_books.extensions.SamplingProfiler": 500,
+}
+
+# JSON file receiving the crawl stats when the spider closes (disabled when empty)
+STATS_DUMP_FILE = ""
+
+# JSON file receiving the timings of the crawl stages (download, callbacks,
+# pipelines, database commits) when the spider closes (disabled when empty)
+PROFILE_REPORT_FILE = ""
+# Output file of the pyinstrument sampling profiler, .html or .txt
+# (disabled when empty, e.g. scrapy crawl booksspider -s PROFILE_SAMPLER=profile.html)
+PROFILE_SAMPLER = ""
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    "scrapy_books.pipelines.CleanTextPipeline": 100,
-    "scrapy_books.pipelines.AvailabilityPipeline": 200,
-    "scrapy_books.pipelines.ConvertRatingPipeline": 300,
+    "scrapy_books.pipelines.NormalizeItemPipeline": 100,
     "scrapy_books.pipelines.SavingToPostgresPipeline": 400,
 }
 
+# Batched writes of SavingToPostgresPipeline: items are flushed to PostgreSQL
+# in one transaction every POSTGRES_BATCH_SIZE items or POSTGRES_BATCH_INTERVAL
+# seconds, and once more when the spider closes (1 = one commit per item)
+POSTGRES_BATCH_SIZE = 100
+POSTGRES_BATCH_INTERVAL = 5
+# Number of connections (and worker threads) used for the writes: it bounds
+# the number of batches in flight and so the backpressure on the crawl
+POSTGRES_POOL_SIZE = 4
+
+# Directory receiving the Parquet snapshot of the catalogue written at the end
+# of each crawl, relative to the Scrapy project (disabled when empty, needs pyarrow)
+SNAPSHOT_DIR = "../snapshots"
+
+# Record the crawl in crawl_runs and write its snapshot when the spider closes;
+# disabled in the shards of run_project.py --shards, which does it once at the end
+RECORD_CRAWL_RUN = True
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
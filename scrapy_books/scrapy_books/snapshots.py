@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar snapshots of the catalogue, written at the end of each crawl.
+
+Each snapshot is one Parquet file (zstd) of the books joined with their
+category and current stock, stored under SNAPSHOT_DIR in a hive-style
+partition crawl_run=<id> so that the crawls can be read back together or
+one at a time (see notebooks/snapshots.py).
+"""
+
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, snapshots are disabled without it
+    pa = pq = None
+
+
+SNAPSHOT_CHUNK_SIZE = 5000
+
+SNAPSHOT_QUERY = """
+    SELECT b.id, b.upc, b.title, b.description, b.rating, c.id, c.name,
+           s.price::float8, s.availability, s.stock_count, s.updated_at
+    FROM books b
+    LEFT JOIN categories c ON c.id = b.category_id
+    LEFT JOIN stocks s ON s.book_id = b.id
+    ORDER BY b.id
+"""
+
+if pa is not None:
+    SNAPSHOT_SCHEMA = pa.schema([
+        ("book_id", pa.int32()),
+        ("upc", pa.string()),
+        ("title", pa.string()),
+        ("description", pa.string()),
+        ("rating", pa.int16()),
+        ("category_id", pa.int32()),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+        ("price", pa.float64()),
+        ("availability", pa.dictionary(pa.int32(), pa.string())),
+        ("stock_count", pa.int32()),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+def to_record_batch(rows):
+    """
+    Convert a list of rows of SNAPSHOT_QUERY to an Arrow record batch.
+    """
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(SNAPSHOT_SCHEMA, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=SNAPSHOT_SCHEMA)
+
+
+def write_snapshot(cursor, snapshot_dir, crawl_run_id):
+    """
+    Write the snapshot of the crawl crawl_run_id to
+    snapshot_dir/crawl_run=<crawl_run_id>/books.parquet and return its path.
+
+    The rows are read with a named (server-side) cursor opened on the
+    connection of cursor, so only SNAPSHOT_CHUNK_SIZE of them are in memory
+    at a time, as in routers/export.py. The file is written under a
+    temporary name and renamed once complete, so a reader never sees a
+    partial snapshot.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required to write the snapshots")
+
+    partition = os.path.join(snapshot_dir, f"crawl_run={crawl_run_id}")
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, "books.parquet")
+    tmp_path = path + ".tmp"
+
+    with cursor.connection.cursor(name="snapshot_books") as rows_cursor:
+        rows_cursor.itersize = SNAPSHOT_CHUNK_SIZE
+        rows_cursor.execute(SNAPSHOT_QUERY)
+        with pq.ParquetWriter(tmp_path, SNAPSHOT_SCHEMA, compression="zstd") as writer:
+            while True:
+                rows = rows_cursor.fetchmany(SNAPSHOT_CHUNK_SIZE)
+                if not rows:
+                    break
+                writer.write_batch(to_record_batch(rows))
+    os.replace(tmp_path, path)
+    return path
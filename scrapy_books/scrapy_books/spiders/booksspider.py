@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import scrapy
-from scrapy_books.items import BooksInformations
-from scrapy_books.itemloaders import BooksInformationsLoader
+from itemadapter import ItemAdapter
+from scrapy_books.items import BooksInformations, StockRefresh
+from scrapy_books.itemloaders import BooksInformationsLoader, clean_price
+from scrapy_books.extractors import extract_book
+from scrapy_books.pagestore import PageStore
+from scrapy_books.pipelines import item_not_written
+from scrapy import signals
 import os
 from dotenv import load_dotenv
 
@@ -13,30 +18,180 @@ class BooksSpider(scrapy.Spider):
     name = "booksspider"
     allowed_domains = ["books.toscrape.com"]
     start_urls = [os.getenv("START_URL")]
+    fast_extractor = False
+    max_age = 86400
+    modes = ("full", "incremental", "refresh")
+
+    def __init__(self, mode="full", shard=0, shards=1, *args, **kwargs):
+        """
+        Initialize the spider in the given mode.
+
+        In "full" mode (the default), every book page is downloaded.
+        In "incremental" mode, book pages fetched less than INCREMENTAL_MAX_AGE
+        seconds ago are skipped, and older ones are requested with their
+        ETag/Last-Modified validators so that unchanged pages answer 304.
+        In "refresh" mode, the price, availability and rating of the known
+        books are read from the listing pages, and only the pages of the
+        books never seen before are downloaded.
+
+        The mode is selected from the command line: scrapy crawl booksspider -a mode=incremental
+
+        With shards greater than 1, the spider only crawls the categories whose
+        index modulo shards equals shard, so N spiders started with shard=0..N-1
+        crawl disjoint partitions of the whole catalogue:
+        scrapy crawl booksspider -a shard=0 -a shards=4
+        """
+        super().__init__(*args, **kwargs)
+        if mode not in self.modes:
+            raise ValueError(f"mode must be one of {', '.join(self.modes)}, got {mode!r}")
+        self.mode = mode
+        self.shard = int(shard)
+        self.shards = int(shards)
+        if not 0 <= self.shard < self.shards:
+            raise ValueError(f"shard must be between 0 and {self.shards - 1}, got {self.shard}")
+        self.pages = PageStore()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.max_age = crawler.settings.getfloat("INCREMENTAL_MAX_AGE", 86400)
+        spider.fast_extractor = crawler.settings.getbool("FAST_EXTRACTOR", False)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.item_not_written, signal=item_not_written)
+        return spider
+
+    def spider_opened(self, spider):
+        """
+        Load the store of the known book pages.
+        """
+        self.pages.load()
+
+    def item_not_written(self, item, spider):
+        """
+        Forget the page of a book that the pipeline could not write, so that
+        it is downloaded again by the next incremental or refresh crawl.
+        """
+        self.pages.forget(ItemAdapter(item).get("upc", ""))
+
+    def closed(self, reason):
+        """
+        Save the pages fetched or revalidated during the crawl.
+        """
+        self.pages.save()
+
+    async def start(self):
+        """
+        Yield the start requests (Scrapy 2.13 and later), see start_requests().
+        """
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        """
+        Yield the start requests. In sharded mode, the start page is only
+        used to list the categories of the catalogue.
+
+        Scrapy versions older than 2.13 only call this method, so the
+        sharding logic lives here and start() delegates to it.
+        """
+        callback = self.parse_categories if self.shards > 1 else self.parse
+        for url in self.start_urls:
+            yield scrapy.Request(url, callback=callback, dont_filter=True)
+
+    def parse_categories(self, response):
+        """
+        Parse the category links of the sidebar, and follow the categories
+        belonging to the shard of this spider.
+        """
+        categories = sorted(response.css("div.side_categories ul li ul li a::attr(href)").getall())
+        for index, relative_url in enumerate(categories):
+            if index % self.shards == self.shard:
+                yield response.follow(relative_url, callback=self.parse)
 
     def parse(self, response):        
         """
-        Parse the page and extract the book URLs, then yield the response.follow() of the book URLs.
+        Parse the page and extract the book URLs, then yield the requests for the book pages.
         Also parse the next page URL and yield the response.follow() of the next page URL.
+        In refresh mode, known books yield a StockRefresh item instead of a request.
         """
         for book in response.css("article.product_pod"):
             relative_url = book.css("h3 a::attr(href)").get(default="")
             if relative_url:
                 full_url = response.urljoin(relative_url)
-                yield response.follow(full_url, callback=self.parse_book)
+                page = self.pages.get(full_url)
+                if self.mode == "refresh" and page is not None:
+                    yield self.parse_refresh(book, page.upc)
+                    continue
 
-            yield response.follow(full_url, callback=self.parse_book)
+                request = self.book_request(full_url)
+                if request is not None:
+                    yield request
 
         next_page = response.css("li.next a::attr(href)").get()
         if next_page:
             yield response.follow(next_page, callback=self.parse)
 
 
+    def parse_refresh(self, book, upc):
+        """
+        Extract the price, availability and rating shown on the listing card of a known book.
+        """
+        return StockRefresh(
+            upc=upc,
+            price=clean_price(book.css(".price_color::text").get(default="0")),
+            availability=" ".join(book.css(".instock.availability::text").getall()).strip(),
+            rating=book.css("p.star-rating::attr(class)").get(default="star-rating Zero"),
+        )
+
+
+    def book_request(self, url):
+        """
+        Return the request for a book page, or None if the page can be skipped.
+
+        Outside of the incremental mode, or for a page never crawled, this is a
+        plain request. Fresh known pages are skipped, and stale ones are
+        requested conditionally.
+        """
+        page = self.pages.get(url)
+        if self.mode != "incremental" or page is None:
+            return scrapy.Request(url, callback=self.parse_book)
+
+        if self.pages.is_fresh(url, self.max_age):
+            self.crawler.stats.inc_value("incremental/skipped")
+            return None
+
+        headers = {}
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return scrapy.Request(
+            url,
+            callback=self.parse_book,
+            headers=headers,
+            meta={"handle_httpstatus_list": [304]},
+        )
+
+
     def parse_book(self, response):
         """
         Parse the book page and extract the book information.
+        A 304 answer to a conditional request only refreshes the page in the store.
+
+        With the FAST_EXTRACTOR setting, the page is extracted by extract_book()
+        into a BookRecord instead of going through the item loader.
         """
-        
+        if response.status == 304:
+            self.crawler.stats.inc_value("incremental/not_modified")
+            self.pages.touch(response.url)
+            return
+
+        if self.fast_extractor:
+            item = extract_book(response)
+            self.record_page(response, item.upc)
+            yield item
+            return
+
         loader = BooksInformationsLoader(item=BooksInformations(), selector=response)
 
         loader.add_css("title", "h1::text", default="Unknown Title")
@@ -60,5 +215,18 @@ class BooksSpider(scrapy.Spider):
                 else:
                     item[field] = ""
 
+        self.record_page(response, item["upc"])
         yield item
+
+
+    def record_page(self, response, upc):
+        """
+        Record the book page in the store with its validators.
+        """
+        self.pages.record(
+            response.url,
+            upc,
+            etag=response.headers.get("ETag", b"").decode() or None,
+            last_modified=response.headers.get("Last-Modified", b"").decode() or None,
+        )
         
\ No newline at end of file
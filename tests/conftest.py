@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+# The API reads its configuration when it is imported: point it to a
+# throwaway SQLite database before any test module imports it.
+os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="books_api_tests_"), "books.db")
+os.environ["DB_ASYNC"] = "0"
+os.environ["SQL_ECHO"] = "0"
+os.environ["CACHE_GENERATION_TTL"] = "3600"
+os.environ.pop("CACHE_URL", None)
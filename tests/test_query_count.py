@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Guard against N+1 queries on the book routes.
+
+Each route must run a fixed number of SQL queries, whatever the number of
+books it returns: the books with their category in one SELECT, and their
+stocks in one more (see crud.query_books). The queries are counted on the
+API engine, backed here by SQLite, during the whole request, serialization
+of the response included.
+
+The ranked search relies on PostgreSQL full-text search and is not covered.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+
+from api.app import models
+from api.app.database import Base, SessionLocal, engine
+from api.app.main import app
+
+BOOK_COUNT = 30
+
+
+@compiles(TSVECTOR, "sqlite")
+def compile_tsvector(element, compiler, **kw):
+    return "TEXT"
+
+
+@event.listens_for(engine, "connect")
+def register_search_functions(dbapi_connection, connection_record):
+    # Stand-ins for the PostgreSQL functions of the search_vector column
+    dbapi_connection.create_function("to_tsvector", 2, lambda config, text: text, deterministic=True)
+    dbapi_connection.create_function("setweight", 2, lambda vector, weight: vector, deterministic=True)
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        categories = [models.Category(name=name) for name in ("Poetry", "Travel", "Mystery")]
+        db.add_all(categories)
+        for index in range(BOOK_COUNT):
+            book = models.Book(
+                upc=f"upc{index:04d}",
+                title=f"Book {index}",
+                description="A book.",
+                rating=index % 6,
+                category=categories[index % len(categories)],
+            )
+            book.stock = models.Stock(
+                price=10 + index,
+                availability="In stock" if index % 2 else "Out of stock",
+                stock_count=index % 2 * 5,
+            )
+            db.add(book)
+        db.add(models.CrawlRun(spider="booksspider"))
+        db.commit()
+
+    with TestClient(app) as client:
+        # Read the crawl generation once, it is then cached for the whole module
+        client.get("/books/", params={"limit": 1})
+        yield client
+
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def queries():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(engine, "before_cursor_execute", count)
+
+
+@pytest.mark.parametrize("path, params, expected", [
+    ("/books/", {}, 2),
+    ("/books/", {"limit": 10, "after_id": 5}, 2),
+    ("/books/", {"fast": "true"}, 1),
+    ("/books/upc0003", {}, 2),
+    ("/books/category/Poetry", {}, 2),
+    ("/books/stock/below/3", {}, 2),
+    ("/books/rating/3", {}, 2),
+    ("/books/stock/in", {}, 2),
+    ("/books/stock/out", {}, 2),
+    ("/categories/", {}, 1),
+])
+def test_query_count(client, queries, path, params, expected):
+    response = client.get(path, params=params)
+
+    assert response.status_code == 200
+    assert len(queries) == expected, queries
+
+
+def test_stream_query_count(client, queries):
+    response = client.get("/books/", params={"stream": "true"})
+
+    assert response.status_code == 200
+    assert len(response.json()) == BOOK_COUNT
+    assert len(queries) == 2, queries
+
+
+def test_top_rated_books_fields(client):
+    response = client.get("/stats/books/top-rated/Poetry")
+
+    assert response.status_code == 200
+    books = response.json()
+    assert [book["rating"] for book in books] == sorted((book["rating"] for book in books), reverse=True)
+    assert all("fingerprint" not in book for book in books)